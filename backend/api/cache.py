@@ -0,0 +1,61 @@
+import functools
+import logging
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from ..services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+# Route parameters that scope a cached response rather than vary it
+SCOPE_PARAMS = ("image_id", "annotation_id")
+
+def response_scope(params: dict) -> str:
+    """The image/annotation a route response belongs to, or "global" """
+    return next((str(params[p]) for p in SCOPE_PARAMS if params.get(p) is not None), "global")
+
+def response_cache_key(route: str, params: dict) -> str:
+    """
+    Build the cache key for a route response.
+    Keys are grouped under their image/annotation, whose index set lets mutations bust them.
+    """
+    varying = ":".join(
+        f"{k}={v}" for k, v in sorted(params.items())
+        if k != "db" and k not in SCOPE_PARAMS
+    )
+    return f"api:{response_scope(params)}:{route}:{varying}"
+
+def cached(route: str, ttl: int = 60):
+    """
+    Cache the serialized JSON response of a read-only route in Redis for `ttl` seconds.
+    Hits are returned as raw bytes with no decode/re-encode; falls straight through to
+    the handler when the cache is unavailable. Only successful results are stored, so
+    handlers must raise rather than return a fallback on failure.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            cache_key = response_cache_key(route, kwargs)
+
+            cached_body = await cache_service.get_response(cache_key)
+            if cached_body is not None:
+                logger.debug(f"Cache hit for response: {cache_key}")
+                return Response(content=cached_body, media_type="application/json")
+
+            response = await func(**kwargs)
+            if isinstance(response, Response):
+                if response.status_code != 200:
+                    return response
+                body = response.body
+            else:
+                body = orjson.dumps(jsonable_encoder(response))
+            await cache_service.set_response(cache_key, body, ttl, scope=response_scope(kwargs))
+            return response
+        return wrapper
+    return decorator
+
+async def invalidate_responses(*scopes: str):
+    """Bust every cached route response for the given image/annotation IDs"""
+    for scope in scopes:
+        await cache_service.invalidate_responses(scope)
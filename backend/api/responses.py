@@ -0,0 +1,15 @@
+import orjson
+from fastapi import Response
+from pydantic import TypeAdapter
+from typing import Any, Sequence
+
+def list_response(adapter: TypeAdapter, key: str, items: Sequence[Any], **fields) -> Response:
+    """
+    Build a JSON object response whose `key` member is `items`, validated from ORM rows and
+    serialized in a single compiled pass by a Pydantic TypeAdapter. `fields` are the other
+    members of the object; a "count" of the items is added automatically.
+    """
+    items = adapter.validate_python(items, from_attributes=True)
+    envelope = orjson.dumps({**fields, "count": len(items)})
+    body = envelope[:-1] + b',"' + key.encode() + b'":' + adapter.dump_json(items) + b"}"
+    return Response(content=body, media_type="application/json")
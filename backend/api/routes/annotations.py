@@ -1,22 +1,24 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from typing import Optional, List
 import logging
 
-from ...services.annotation_service import AnnotationService
-from ...models.schemas import Annotation, AnnotationCreate, AnnotationUpdate, UserFeedbackCreate
+from ...services.annotation_service import annotation_service, EXPORT_FORMATS
+from ..cache import cached, invalidate_responses
+from ...models.schemas import Annotation, AnnotationCreate, AnnotationUpdate, UserFeedbackCreate, AnnotationList, FeedbackItemList
+from ..responses import list_response
+from ...models.models import Annotation as AnnotationModel, UserFeedback as UserFeedbackModel
 from ...models.database import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Initialize annotation service
-annotation_service = AnnotationService()
-
 @router.post("/", response_model=Annotation)
 async def create_annotation(
     annotation: AnnotationCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create a new annotation
@@ -26,6 +28,7 @@ async def create_annotation(
             annotation_data=annotation,
             db=db
         )
+        await invalidate_responses(created_annotation.image_id)
         
         return created_annotation
         
@@ -33,22 +36,47 @@ async def create_annotation(
         logger.error(f"Error creating annotation: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error creating annotation: {str(e)}")
 
+@router.post("/bulk")
+async def create_annotations_bulk(
+    annotations: List[AnnotationCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Create many annotations in a single batched insert
+    """
+    try:
+        annotation_ids = await annotation_service.create_annotations_bulk(
+            items=annotations,
+            db=db
+        )
+        await invalidate_responses(*{annotation.image_id for annotation in annotations})
+        
+        return {
+            "message": "Annotations created successfully",
+            "annotation_ids": annotation_ids,
+            "count": len(annotation_ids)
+        }
+        
+    except Exception as e:
+        logger.error(f"Error creating annotations in bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error creating annotations: {str(e)}")
+
 @router.get("/{annotation_id}", response_model=Annotation)
+@cached("annotation")
 async def get_annotation(
     annotation_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get a specific annotation by ID
     """
     try:
-        from ...models.models import Annotation as AnnotationModel
-        
-        annotation = db.query(AnnotationModel).filter(AnnotationModel.id == annotation_id).first()
+        result = await db.execute(select(AnnotationModel).where(AnnotationModel.id == annotation_id))
+        annotation = result.scalar_one_or_none()
         if not annotation:
             raise HTTPException(status_code=404, detail="Annotation not found")
         
-        return annotation
+        return Annotation.model_validate(annotation)
         
     except HTTPException:
         raise
@@ -60,7 +88,7 @@ async def get_annotation(
 async def update_annotation(
     annotation_id: str,
     annotation_update: AnnotationUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Update an annotation
@@ -74,6 +102,7 @@ async def update_annotation(
         
         if not updated_annotation:
             raise HTTPException(status_code=404, detail="Annotation not found")
+        await invalidate_responses(updated_annotation.image_id, annotation_id)
         
         return updated_annotation
         
@@ -86,19 +115,20 @@ async def update_annotation(
 @router.delete("/{annotation_id}")
 async def delete_annotation(
     annotation_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete an annotation
     """
     try:
-        success = await annotation_service.delete_annotation(
+        image_id = await annotation_service.delete_annotation(
             annotation_id=annotation_id,
             db=db
         )
         
-        if not success:
+        if not image_id:
             raise HTTPException(status_code=404, detail="Annotation not found")
+        await invalidate_responses(image_id, annotation_id)
         
         return {"message": "Annotation deleted successfully"}
         
@@ -109,13 +139,14 @@ async def delete_annotation(
         raise HTTPException(status_code=500, detail=f"Error deleting annotation: {str(e)}")
 
 @router.get("/image/{image_id}")
+@cached("annotations")
 async def get_image_annotations(
     image_id: str,
     z: Optional[int] = Query(None, description="Filter by zoom level"),
     x: Optional[int] = Query(None, description="Filter by x coordinate"),
     y: Optional[int] = Query(None, description="Filter by y coordinate"),
     annotation_type: Optional[str] = Query(None, description="Filter by annotation type"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get all annotations for an image with optional filters
@@ -126,27 +157,21 @@ async def get_image_annotations(
             db=db,
             z=z,
             x=x,
-            y=y
+            y=y,
+            annotation_type=annotation_type
         )
         
-        # Apply additional filters
-        if annotation_type:
-            annotations = [a for a in annotations if a.annotation_type == annotation_type]
-        
-        return {
-            "image_id": image_id,
-            "annotations": [annotation.dict() for annotation in annotations],
-            "count": len(annotations)
-        }
+        return list_response(AnnotationList, "annotations", annotations, image_id=image_id)
         
     except Exception as e:
         logger.error(f"Error getting annotations for image {image_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting annotations: {str(e)}")
 
 @router.get("/image/{image_id}/stats")
+@cached("annotation_stats")
 async def get_annotation_stats(
     image_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get annotation statistics for an image
@@ -157,10 +182,11 @@ async def get_annotation_stats(
             db=db
         )
         
-        return {
+        # Plain dict of JSON-native values: hand it straight to orjson
+        return ORJSONResponse({
             "image_id": image_id,
             "stats": stats
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error getting annotation stats for {image_id}: {str(e)}")
@@ -169,14 +195,12 @@ async def get_annotation_stats(
 @router.post("/feedback")
 async def submit_feedback(
     feedback: UserFeedbackCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Submit user feedback for annotations or ML results
     """
     try:
-        from ...models.models import UserFeedback as UserFeedbackModel
-        
         user_feedback = UserFeedbackModel(
             image_id=feedback.image_id,
             tile_coordinates=feedback.tile_coordinates,
@@ -186,8 +210,8 @@ async def submit_feedback(
         )
         
         db.add(user_feedback)
-        db.commit()
-        db.refresh(user_feedback)
+        await db.commit()
+        await db.refresh(user_feedback)
         
         return {
             "message": "Feedback submitted successfully",
@@ -196,41 +220,27 @@ async def submit_feedback(
         
     except Exception as e:
         logger.error(f"Error submitting feedback: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error submitting feedback: {str(e)}")
 
 @router.get("/feedback/{image_id}")
 async def get_feedback(
     image_id: str,
     feedback_type: Optional[str] = Query(None, description="Filter by feedback type"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get user feedback for an image
     """
     try:
-        from ...models.models import UserFeedback as UserFeedbackModel
-        
-        query = db.query(UserFeedbackModel).filter(UserFeedbackModel.image_id == image_id)
+        query = select(UserFeedbackModel).where(UserFeedbackModel.image_id == image_id)
         
         if feedback_type:
-            query = query.filter(UserFeedbackModel.feedback_type == feedback_type)
+            query = query.where(UserFeedbackModel.feedback_type == feedback_type)
         
-        feedback_items = query.all()
+        feedback_items = (await db.execute(query)).scalars().all()
         
-        return {
-            "image_id": image_id,
-            "feedback": [
-                {
-                    "id": item.id,
-                    "feedback_type": item.feedback_type,
-                    "content": item.content,
-                    "created_at": item.created_at.isoformat()
-                }
-                for item in feedback_items
-            ],
-            "count": len(feedback_items)
-        }
+        return list_response(FeedbackItemList, "feedback", feedback_items, image_id=image_id)
         
     except Exception as e:
         logger.error(f"Error getting feedback for {image_id}: {str(e)}")
@@ -240,20 +250,25 @@ async def get_feedback(
 async def export_annotations(
     image_id: str,
     format: str = Query("json", description="Export format: json, coco"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Export annotations in various formats
     """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    
     try:
-        export_data = await annotation_service.export_annotations(
-            image_id=image_id,
-            db=db,
-            format=format
+        # The db session stays open until the response body has been fully sent
+        return StreamingResponse(
+            annotation_service.stream_export(
+                image_id=image_id,
+                db=db,
+                format=format
+            ),
+            media_type="application/json"
         )
         
-        return export_data
-        
     except Exception as e:
         logger.error(f"Error exporting annotations for {image_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error exporting annotations: {str(e)}")
@@ -1,29 +1,76 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Path, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from typing import Optional, List
 import logging
+import orjson
 
-from ...services.annotation_service import AnnotationService
-from ...models.schemas import Annotation, ImageMetadata, TileMetadata
+from ...services.annotation_service import annotation_service, EXPORT_FORMATS
+from ..cache import cached
+from ...models.schemas import Annotation, ImageMetadata, TileMetadata, AnnotationList
+from ..responses import list_response
+from ...models.models import TileMetadata as TileMetadataModel
 from ...models.database import get_db
-from sqlalchemy.orm import Session
+from ...config import settings
+from sqlalchemy import select, lambda_stmt, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Initialize annotation service
-annotation_service = AnnotationService()
+# Static model catalogue, serialized once at import
+# This would typically come from the ML service
+MODEL_VERSIONS_PAYLOAD = orjson.dumps({
+    "models": {
+        "super_resolution": {
+            "name": "Real-ESRGAN",
+            "version": "1.0.0",
+            "description": "Super-resolution model for enhancing image clarity"
+        },
+        "denoising": {
+            "name": "DnCNN",
+            "version": "1.0.0", 
+            "description": "Denoising model for cleaning space imagery"
+        },
+        "segmentation": {
+            "name": "U-Net",
+            "version": "1.0.0",
+            "description": "Semantic segmentation for feature detection"
+        },
+        "classification": {
+            "name": "ResNet",
+            "version": "1.0.0",
+            "description": "Feature classification model"
+        }
+    },
+    "last_updated": "2024-01-01T00:00:00Z"
+})
+
+# Hot-path tile lookup, built and compiled once; per-request values are bound parameters
+TILE_METADATA_STMT = lambda_stmt(
+    lambda: select(TileMetadataModel).where(
+        TileMetadataModel.image_id == bindparam("image_id"),
+        TileMetadataModel.z == bindparam("z"),
+        TileMetadataModel.x == bindparam("x"),
+        TileMetadataModel.y == bindparam("y")
+    )
+)
 
 @router.get("/{image_id}/{z}/{x}/{y}")
+@cached("tile_metadata")
 async def get_tile_metadata(
     image_id: str,
-    z: int,
-    x: int,
-    y: int,
-    db: Session = Depends(get_db)
+    z: int = Path(..., ge=0, le=settings.max_zoom, description="Zoom level"),
+    x: int = Path(..., ge=0, description="X coordinate"),
+    y: int = Path(..., ge=0, description="Y coordinate"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get metadata for a specific tile including annotations and ML results
     """
+    # A zoom level z has 2**z tiles per axis; reject anything outside it before touching the database
+    if x >= 2 ** z or y >= 2 ** z:
+        raise HTTPException(status_code=422, detail=f"Tile {x},{y} is out of range for zoom level {z}")
+    
     try:
         # Get annotations for this tile
         annotations = await annotation_service.get_annotations(
@@ -35,18 +82,17 @@ async def get_tile_metadata(
         )
         
         # Get tile metadata from database
-        tile_metadata = db.query(TileMetadata).filter(
-            TileMetadata.image_id == image_id,
-            TileMetadata.z == z,
-            TileMetadata.x == x,
-            TileMetadata.y == y
-        ).first()
+        result = await db.execute(
+            TILE_METADATA_STMT,
+            {"image_id": image_id, "z": z, "x": x, "y": y}
+        )
+        tile_metadata = result.scalar_one_or_none()
         
         return {
             "image_id": image_id,
             "tile_coordinates": {"z": z, "x": x, "y": y},
-            "annotations": [annotation.dict() for annotation in annotations],
-            "tile_metadata": tile_metadata.dict() if tile_metadata else None,
+            "annotations": AnnotationList.validate_python(annotations, from_attributes=True),
+            "tile_metadata": TileMetadata.model_validate(tile_metadata) if tile_metadata else None,
             "annotation_count": len(annotations)
         }
         
@@ -55,11 +101,12 @@ async def get_tile_metadata(
         raise HTTPException(status_code=500, detail=f"Error getting tile metadata: {str(e)}")
 
 @router.get("/{image_id}/annotations")
+@cached("image_annotations")
 async def get_image_annotations(
     image_id: str,
     annotation_type: Optional[str] = Query(None, description="Filter by annotation type"),
     min_confidence: Optional[float] = Query(None, ge=0.0, le=1.0, description="Minimum confidence threshold"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get all annotations for an image with optional filters
@@ -67,30 +114,22 @@ async def get_image_annotations(
     try:
         annotations = await annotation_service.get_annotations(
             image_id=image_id,
-            db=db
+            db=db,
+            annotation_type=annotation_type,
+            min_confidence=min_confidence
         )
         
-        # Apply filters
-        if annotation_type:
-            annotations = [a for a in annotations if a.annotation_type == annotation_type]
-        
-        if min_confidence is not None:
-            annotations = [a for a in annotations if a.confidence and a.confidence >= min_confidence]
-        
-        return {
-            "image_id": image_id,
-            "annotations": [annotation.dict() for annotation in annotations],
-            "count": len(annotations)
-        }
+        return list_response(AnnotationList, "annotations", annotations, image_id=image_id)
         
     except Exception as e:
         logger.error(f"Error getting annotations for {image_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting annotations: {str(e)}")
 
 @router.get("/{image_id}/stats")
+@cached("image_stats")
 async def get_image_stats(
     image_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get statistics for an image including annotation counts and ML metrics
@@ -101,10 +140,11 @@ async def get_image_stats(
             db=db
         )
         
-        return {
+        # Plain dict of JSON-native values: hand it straight to orjson
+        return ORJSONResponse({
             "image_id": image_id,
             "stats": stats
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error getting stats for {image_id}: {str(e)}")
@@ -116,7 +156,7 @@ async def search_metadata(
     image_id: Optional[str] = Query(None, description="Filter by image ID"),
     annotation_type: Optional[str] = Query(None, description="Filter by annotation type"),
     min_confidence: Optional[float] = Query(None, ge=0.0, le=1.0, description="Minimum confidence"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Search annotations and metadata
@@ -130,11 +170,7 @@ async def search_metadata(
             min_confidence=min_confidence
         )
         
-        return {
-            "query": query,
-            "results": [annotation.dict() for annotation in annotations],
-            "count": len(annotations)
-        }
+        return list_response(AnnotationList, "results", annotations, query=query)
         
     except Exception as e:
         logger.error(f"Error searching metadata: {str(e)}")
@@ -144,20 +180,25 @@ async def search_metadata(
 async def export_metadata(
     image_id: str,
     format: str = Query("json", description="Export format: json, coco"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Export metadata and annotations in various formats
     """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    
     try:
-        export_data = await annotation_service.export_annotations(
-            image_id=image_id,
-            db=db,
-            format=format
+        # The db session stays open until the response body has been fully sent
+        return StreamingResponse(
+            annotation_service.stream_export(
+                image_id=image_id,
+                db=db,
+                format=format
+            ),
+            media_type="application/json"
         )
         
-        return export_data
-        
     except Exception as e:
         logger.error(f"Error exporting metadata for {image_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error exporting metadata: {str(e)}")
@@ -167,36 +208,4 @@ async def get_model_versions():
     """
     Get information about available ML models and their versions
     """
-    try:
-        # This would typically come from the ML service
-        models = {
-            "super_resolution": {
-                "name": "Real-ESRGAN",
-                "version": "1.0.0",
-                "description": "Super-resolution model for enhancing image clarity"
-            },
-            "denoising": {
-                "name": "DnCNN",
-                "version": "1.0.0", 
-                "description": "Denoising model for cleaning space imagery"
-            },
-            "segmentation": {
-                "name": "U-Net",
-                "version": "1.0.0",
-                "description": "Semantic segmentation for feature detection"
-            },
-            "classification": {
-                "name": "ResNet",
-                "version": "1.0.0",
-                "description": "Feature classification model"
-            }
-        }
-        
-        return {
-            "models": models,
-            "last_updated": "2024-01-01T00:00:00Z"
-        }
-        
-    except Exception as e:
-        logger.error(f"Error getting model versions: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error getting model versions: {str(e)}")
+    return Response(content=MODEL_VERSIONS_PAYLOAD, media_type="application/json")
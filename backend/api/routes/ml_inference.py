@@ -1,13 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from typing import List, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Response
+from typing import List, Dict, Any, Optional
 import logging
 import asyncio
+import io
+import orjson
+from PIL import Image
 
 from ...services.ml_service import MLService
 from ...services.tile_service import TileService
 from ...models.schemas import MLInferenceRequest, MLInferenceResponse, PrecomputeRequest
 from ...models.database import get_db
-from sqlalchemy.orm import Session
+from ...config import settings
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -15,12 +19,36 @@ logger = logging.getLogger(__name__)
 # Import shared global instances
 from ...services.ml_service import ml_service
 from ...services.tile_service import tile_service
+from ...services.inference_store import inference_store
+
+# Serialized /models/status payload, kept fresh by refresh_models_status()
+_models_status_payload: Optional[bytes] = None
+
+async def _build_models_status() -> bytes:
+    """Run the ML health check and serialize the models status response"""
+    health_check = await ml_service.health_check()
+    return orjson.dumps({
+        "ml_service": health_check,
+        "available_operations": ["sr", "denoise", "segment", "classify"],
+        "supported_formats": ["JPEG", "PNG", "TIFF"],
+        "max_tile_size": 1024
+    })
+
+async def refresh_models_status(interval: float = 30.0):
+    """Rebuild the models status payload every `interval` seconds instead of on every poll"""
+    global _models_status_payload
+    while True:
+        try:
+            _models_status_payload = await _build_models_status()
+        except Exception as e:
+            logger.error(f"Error refreshing models status: {str(e)}")
+        await asyncio.sleep(interval)
 
 @router.post("/infer", response_model=MLInferenceResponse)
 async def run_inference(
     request: MLInferenceRequest,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Run ML inference on a specific tile
@@ -58,43 +86,49 @@ async def run_inference(
         features_detected = []
         model_versions = {}
         
-        # Convert bytes to PIL Image for processing
-        from PIL import Image
-        import io
-        image = Image.open(io.BytesIO(original_tile))
+        # Convert bytes to PIL Image for processing, decoding off the event loop
+        image = await asyncio.to_thread(lambda: Image.open(io.BytesIO(original_tile)).convert("RGB"))
         
-        # Super-resolution
+        # The image operations are independent, so run the requested ones concurrently
+        tasks = {}
         if "sr" in request.operations:
-            try:
-                sr_image = await ml_service.super_resolve(image)
-                results["sr"] = sr_image
+            tasks["sr"] = ml_service.super_resolve(image)
+        if "denoise" in request.operations:
+            tasks["denoise"] = ml_service.denoise(image)
+        if "segment" in request.operations:
+            tasks["segment"] = ml_service._detect_features(image, request.confidence_threshold)
+        
+        done = dict(zip(tasks, await asyncio.gather(*tasks.values(), return_exceptions=True)))
+        
+        # Super-resolution
+        if "sr" in done:
+            if isinstance(done["sr"], Exception):
+                logger.error(f"Error in super-resolution: {str(done['sr'])}")
+                results["sr"] = image  # Fallback to original
+            else:
+                results["sr"] = done["sr"]
                 confidence_scores["sr"] = 0.95  # This would come from actual model
                 model_versions["sr"] = "Real-ESRGAN-1.0.0"
-            except Exception as e:
-                logger.error(f"Error in super-resolution: {str(e)}")
-                results["sr"] = image  # Fallback to original
         
         # Denoising
-        if "denoise" in request.operations:
-            try:
-                denoised_image = await ml_service.denoise(image)
-                results["denoise"] = denoised_image
+        if "denoise" in done:
+            if isinstance(done["denoise"], Exception):
+                logger.error(f"Error in denoising: {str(done['denoise'])}")
+                results["denoise"] = image
+            else:
+                results["denoise"] = done["denoise"]
                 confidence_scores["denoise"] = 0.88
                 model_versions["denoise"] = "DnCNN-1.0.0"
-            except Exception as e:
-                logger.error(f"Error in denoising: {str(e)}")
-                results["denoise"] = image
         
         # Segmentation
-        if "segment" in request.operations:
-            try:
-                features = await ml_service._detect_features(image, request.confidence_threshold)
-                features_detected = features
+        if "segment" in done:
+            if isinstance(done["segment"], Exception):
+                logger.error(f"Error in segmentation: {str(done['segment'])}")
+                features_detected = []
+            else:
+                features_detected = done["segment"]
                 confidence_scores["segment"] = 0.92
                 model_versions["segment"] = "U-Net-1.0.0"
-            except Exception as e:
-                logger.error(f"Error in segmentation: {str(e)}")
-                features_detected = []
         
         # Classification
         if "classify" in request.operations:
@@ -154,15 +188,16 @@ async def get_ml_status(image_id: str):
     Get the AI processing status for an image
     """
     try:
-        if not tile_service.cache_service.connected:
-            await tile_service.cache_service.initialize()
-            
-        status = await tile_service.cache_service.get_tile(f"status:{image_id}")
+        # The shared cache is connected once at app startup
+        status = await tile_service.cache_service.get_status(f"status:{image_id}")
+        in_progress = await tile_service.cache_service.is_locked(f"lock:{image_id}")
         if status:
-            import json
-            return json.loads(status.decode())
+            return {**status, "in_progress": in_progress}
+        
+        if in_progress:
+            return {"status": "processing", "progress": 0, "in_progress": True}
         
-        return {"status": "available", "progress": 0}
+        return {"status": "available", "progress": 0, "in_progress": False}
         
     except Exception as e:
         logger.error(f"Error getting status for {image_id}: {str(e)}")
@@ -174,14 +209,8 @@ async def get_models_status():
     Get status of all ML models
     """
     try:
-        health_check = await ml_service.health_check()
-        
-        return {
-            "ml_service": health_check,
-            "available_operations": ["sr", "denoise", "segment", "classify"],
-            "supported_formats": ["JPEG", "PNG", "TIFF"],
-            "max_tile_size": 1024
-        }
+        payload = _models_status_payload or await _build_models_status()
+        return Response(content=payload, media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error getting models status: {str(e)}")
@@ -191,7 +220,7 @@ async def get_models_status():
 async def batch_inference(
     requests: List[MLInferenceRequest],
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Run ML inference on multiple tiles in batch
@@ -220,12 +249,21 @@ async def batch_inference(
 async def precompute_enhanced_tiles(
     request: PrecomputeRequest,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Precompute enhanced tiles for an image
     """
     try:
+        # Client retries shouldn't queue a second run; the background task takes the lock itself
+        if await tile_service.cache_service.is_locked(f"lock:{request.image_id}"):
+            return {
+                "message": "Precomputation already in progress",
+                "image_id": request.image_id,
+                "zoom_levels": request.zoom_levels,
+                "operations": request.operations
+            }
+        
         # Start precomputation in background
         background_tasks.add_task(
             _precompute_tiles_background,
@@ -257,13 +295,22 @@ async def _store_inference_results(
     model_versions: Dict[str, str],
     processing_time: float
 ):
-    """Store inference results in database"""
+    """Queue inference results for a batched insert into tile_metadata"""
     try:
-        from ...models.models import TileMetadata
+        enhanced = results.get("sr") is not None or results.get("denoise") is not None
         
-        # This would be done with proper database session
-        # For now, just log the results
-        logger.info(f"Stored inference results for {image_id}/{z}/{x}/{y}")
+        await inference_store.add({
+            "image_id": image_id,
+            "z": z,
+            "x": x,
+            "y": y,
+            "enhanced": "true" if enhanced else "false",
+            "model_version": ",".join(model_versions.values()) or None,
+            "processing_time": processing_time,
+            "confidence_scores": confidence_scores,
+            "features_detected": features_detected
+        })
+        logger.debug(f"Queued inference results for {image_id}/{z}/{x}/{y}")
         
     except Exception as e:
         logger.error(f"Error storing inference results: {str(e)}")
@@ -296,14 +343,20 @@ async def _precompute_tiles_background(
     operations: List[str]
 ):
     """Background task for precomputing tiles with progress updates and REAL work"""
+    # Only one precompute per image at a time; duplicates no-op
+    lock_key = f"lock:{image_id}"
+    lock_token = await tile_service.cache_service.acquire_lock(lock_key, ttl=3600)
+    if lock_token is None:
+        logger.info(f"Precomputation already in progress for {image_id}, skipping")
+        return
+    
     try:
         logger.info(f"--- 🚀 AI PRECOMPUTATION STARTED: {image_id} ---")
         
         # 1. Update status to 'processing'
-        import json
         async def update_status(progress):
             status_data = {"status": "processing", "progress": progress}
-            await tile_service.cache_service.set_tile(f"status:{image_id}", json.dumps(status_data).encode())
+            await tile_service.cache_service.set_status(f"status:{image_id}", status_data)
 
         await update_status(5)
 
@@ -315,21 +368,32 @@ async def _precompute_tiles_background(
                 await update_status(int(10 + (i * 9)))
         else:
             # 2. REAL WORK: Trigger tile processing to fill cache
+            # Load the source once up front so the concurrent levels share it
+            await tile_service._get_source_image(image_url)
+            
             total_levels = len(zoom_levels)
-            for i, z in enumerate(zoom_levels):
-                logger.info(f"🧠 AI Processing Level {z}...")
-                
-                # Fetch center tiles to "warm up" the view
-                # This actually executes the CV2 denoising and sharpening logic!
-                await tile_service.get_dynamic_tile(image_url, z, 0, 0, enhance=True)
+            completed = 0
+            semaphore = asyncio.Semaphore(settings.precompute_concurrency)
+            
+            async def process_level(z):
+                nonlocal completed
+                async with semaphore:
+                    logger.info(f"🧠 AI Processing Level {z}...")
+                    
+                    # Fetch center tiles to "warm up" the view
+                    # This actually executes the CV2 denoising and sharpening logic!
+                    await tile_service.get_dynamic_tile(image_url, z, 0, 0, enhance=True)
                 
-                progress = int(10 + ((i + 1) / total_levels) * 85)
+                completed += 1
+                progress = int(10 + (completed / total_levels) * 85)
                 await update_status(progress)
                 logger.info(f"✅ Level {z} Optimized ({progress}%)")
+            
+            await asyncio.gather(*(process_level(z) for z in zoom_levels))
         
         # 3. Mark as completed
         status_data = {"status": "completed", "progress": 100}
-        await tile_service.cache_service.set_tile(f"status:{image_id}", json.dumps(status_data).encode())
+        await tile_service.cache_service.set_status(f"status:{image_id}", status_data)
         logger.info(f"--- ✨ AI ENHANCEMENT COMPLETE: {image_id} ---")
         
     except Exception as e:
@@ -337,4 +401,6 @@ async def _precompute_tiles_background(
         import traceback
         logger.error(traceback.format_exc())
         status_data = {"status": "error", "message": str(e)}
-        await tile_service.cache_service.set_tile(f"status:{image_id}", json.dumps(status_data).encode())
+        await tile_service.cache_service.set_status(f"status:{image_id}", status_data)
+    finally:
+        await tile_service.cache_service.release_lock(lock_key, lock_token)
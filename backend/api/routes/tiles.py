@@ -1,13 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Response
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Query, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse, ORJSONResponse, FileResponse
 from typing import Optional
 import io
 import logging
+import uuid
 
 from ...services.tile_service import TileService
+from ...services.cache_backends import (
+    tile_cache_key, dynamic_tile_cache_key, tile_etag, etag_matches,
+    negotiate_tile_format, TILE_MEDIA_TYPES
+)
 from ...models.schemas import TileRequest
-from ...models.database import get_db
-from sqlalchemy.orm import Session
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -17,14 +20,15 @@ from ...services.tile_service import tile_service
 
 @router.get("/{image_id}/{z}/{x}/{y}")
 async def get_tile(
+    request: Request,
     image_id: str,
     z: int,
     x: int,
     y: int,
     enhance: bool = Query(False, description="Apply ML enhancement"),
     labels: bool = Query(False, description="Overlay feature labels"),
-    confidence_threshold: float = Query(0.5, ge=0.0, le=1.0, description="Minimum confidence for labels"),
-    db: Session = Depends(get_db)
+    confidence_threshold: float = Query(0.5, ge=0.0, le=1.0, allow_inf_nan=False, description="Minimum confidence for labels"),
+    chunked: bool = Query(False, description="Send the encoded tile with chunked transfer encoding instead of a buffered response")
 ):
     """
     Get a tile with optional ML enhancement
@@ -36,8 +40,30 @@ async def get_tile(
     - **enhance**: Whether to apply ML enhancement (super-resolution, denoising)
     - **labels**: Whether to overlay detected features
     - **confidence_threshold**: Minimum confidence for displaying labels
+    - **chunked**: Opt in to chunked transfer encoding; the tile is encoded in full either way, so buffered responses keep their Content-Length
+    
+    Tiles are served as WebP when the Accept header allows it, JPEG otherwise.
     """
+    format = negotiate_tile_format(request.headers.get("accept"))
+    # Conditional requests for this tile are answered with 304 by the tile cache middleware
+    headers = {
+        "Cache-Control": "public, max-age=3600",
+        "ETag": tile_etag(tile_cache_key(image_id, z, x, y, enhance, labels, confidence_threshold, format)),
+        "Vary": "Accept",
+        "X-Tile-Enhanced": str(enhance),
+        "X-Tile-Labels": str(labels)
+    }
+    media_type = TILE_MEDIA_TYPES[format]
+    if tile_service.is_known_missing(image_id, z, x, y):
+        # Recently found nowhere: answer without probing disk again
+        raise HTTPException(status_code=404, detail="Tile not found")
     try:
+        if not enhance and not labels and format == "jpeg":
+            # Nothing to change in the pixels: sendfile the source JPEG, skipping decode, encode and cache
+            tile_path = tile_service.passthrough_tile_path(image_id, z, x, y)
+            if tile_path:
+                return FileResponse(tile_path, media_type=media_type, headers=headers)
+        
         tile_data = await tile_service.get_tile(
             image_id=image_id,
             z=z,
@@ -45,21 +71,16 @@ async def get_tile(
             y=y,
             enhance=enhance,
             labels=labels,
-            confidence_threshold=confidence_threshold
+            confidence_threshold=confidence_threshold,
+            format=format
         )
         
         if not tile_data:
             raise HTTPException(status_code=404, detail="Tile not found")
         
-        return Response(
-            content=tile_data,
-            media_type="image/jpeg",
-            headers={
-                "Cache-Control": "public, max-age=3600",
-                "X-Tile-Enhanced": str(enhance),
-                "X-Tile-Labels": str(labels)
-            }
-        )
+        if chunked:
+            return StreamingResponse(tile_service.stream_tile(tile_data), media_type=media_type, headers=headers)
+        return Response(content=tile_data, media_type=media_type, headers=headers)
         
     except HTTPException:
         raise
@@ -68,7 +89,7 @@ async def get_tile(
         raise HTTPException(status_code=500, detail=f"Error processing tile: {str(e)}")
 
 @router.get("/proxy/info.json")
-async def get_proxy_info(url: str, db: Session = Depends(get_db)):
+async def get_proxy_info(url: str):
     """
     Get IIIF info.json for an external image URL
     """
@@ -76,26 +97,32 @@ async def get_proxy_info(url: str, db: Session = Depends(get_db)):
         info = await tile_service.get_iiif_info(url)
         if not info:
             raise HTTPException(status_code=400, detail="Could not retrieve image info")
-        return info
+        return ORJSONResponse(info)
     except Exception as e:
         logger.error(f"Error proxying info: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/proxy/tile")
 async def get_proxy_tile(
+    request: Request,
     url: str,
     z: int = Query(...),
     x: int = Query(...),
     y: int = Query(...),
     enhance: bool = Query(False),
     labels: bool = Query(False),
-    confidence_threshold: float = Query(0.5),
-    quality: int = Query(90),
-    db: Session = Depends(get_db)
+    confidence_threshold: float = Query(0.5, ge=0.0, le=1.0, allow_inf_nan=False),
+    quality: int = Query(90, ge=1, le=100),
+    chunked: bool = Query(False)
 ):
     """
     Serve a dynamic tile for an external image URL
     """
+    format = negotiate_tile_format(request.headers.get("accept"))
+    etag = tile_etag(dynamic_tile_cache_key(url, z, x, y, enhance, labels, confidence_threshold, quality, format))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "public, max-age=3600", "Vary": "Accept"})
+    
     try:
         tile_data = await tile_service.get_dynamic_tile(
             image_url=url,
@@ -104,57 +131,78 @@ async def get_proxy_tile(
             y=y,
             enhance=enhance,
             labels=labels,
-            confidence_threshold=confidence_threshold
+            confidence_threshold=confidence_threshold,
+            quality=quality,
+            format=format
         )
         
         if not tile_data:
             raise HTTPException(status_code=404, detail="Tile generation failed")
             
-        return Response(
-            content=tile_data,
-            media_type="image/jpeg",
-            headers={"Cache-Control": "public, max-age=3600"}
-        )
+        headers = {"Cache-Control": "public, max-age=3600", "ETag": etag, "Vary": "Accept"}
+        media_type = TILE_MEDIA_TYPES[format]
+        if chunked:
+            return StreamingResponse(tile_service.stream_tile(tile_data), media_type=media_type, headers=headers)
+        return Response(content=tile_data, media_type=media_type, headers=headers)
     except Exception as e:
         logger.error(f"Error proxying tile: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/precompute")
+@router.post("/precompute", status_code=202)
 async def precompute_tiles(
     image_id: str,
+    background_tasks: BackgroundTasks,
     zoom_levels: list[int] = Query(..., description="Zoom levels to precompute"),
-    enhance: bool = Query(True, description="Whether to apply enhancement"),
-    db: Session = Depends(get_db)
+    enhance: bool = Query(True, description="Whether to apply enhancement")
 ):
     """
-    Precompute tiles for an image at specified zoom levels
+    Queue precomputation of tiles for an image at specified zoom levels
     """
     try:
-        results = await tile_service.precompute_tiles(
+        job_id = uuid.uuid4().hex
+        await tile_service.cache_service.set_status(
+            f"precompute:{job_id}",
+            {"status": "queued", "image_id": image_id, "done": 0, "total": 0}
+        )
+        background_tasks.add_task(
+            tile_service.precompute_tiles,
             image_id=image_id,
             zoom_levels=zoom_levels,
-            enhance=enhance
+            enhance=enhance,
+            job_id=job_id
         )
         
         return {
             "message": "Tile precomputation started",
+            "job_id": job_id,
+            "status": "queued",
             "image_id": image_id,
             "zoom_levels": zoom_levels,
-            "enhance": enhance,
-            "results": results
+            "enhance": enhance
         }
         
     except Exception as e:
         logger.error(f"Error precomputing tiles for {image_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error precomputing tiles: {str(e)}")
 
+@router.get("/precompute/{job_id}")
+async def get_precompute_status(job_id: str):
+    """
+    Get progress of a queued tile precomputation job
+    """
+    status = await tile_service.cache_service.get_status(f"precompute:{job_id}")
+    if not status:
+        raise HTTPException(status_code=404, detail="Precompute job not found")
+    
+    return {"job_id": job_id, **status}
+
 @router.delete("/{image_id}/cache")
-async def clear_tile_cache(image_id: str, db: Session = Depends(get_db)):
+async def clear_tile_cache(image_id: str):
     """
     Clear cache for all tiles of an image
     """
     try:
-        await tile_service.cache_service.invalidate_image(image_id)
+        await tile_service.tile_cache.invalidate_image(image_id)
         
         return {
             "message": f"Cache cleared for image {image_id}",
@@ -166,12 +214,12 @@ async def clear_tile_cache(image_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error clearing cache: {str(e)}")
 
 @router.get("/{image_id}/cache/stats")
-async def get_cache_stats(image_id: str, db: Session = Depends(get_db)):
+async def get_cache_stats(image_id: str):
     """
     Get cache statistics for an image
     """
     try:
-        stats = await tile_service.cache_service.get_cache_stats()
+        stats = await tile_service.cache_service.get_cache_stats(image_id=image_id)
         
         return {
             "image_id": image_id,
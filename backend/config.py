@@ -1,29 +1,49 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, Literal
 import os
 
 class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite:///./nasa_deep_zoom.db"
+    db_pool_size: int = 25
+    db_max_overflow: int = 40
     
     # Redis Cache
     redis_url: str = "redis://localhost:6379"
+    redis_pool_size: int = 50
+    redis_pool_min: int = 10  # Connections opened at startup so the first requests skip the TCP handshake
+    redis_pool_timeout: float = 2.0  # Seconds a request waits for a free pooled connection before erroring
+    memory_cache_mb: int = 64  # Byte budget of the in-process tile fallback, split across size classes
     
     # AWS S3 (optional)
     aws_access_key_id: Optional[str] = None
     aws_secret_access_key: Optional[str] = None
     aws_region: str = "us-east-1"
     s3_bucket: Optional[str] = None
+    s3_cache_prefix: str = "tile-cache/"
+    s3_io_threads: int = 16  # Blocking boto3 calls get their own pool so they never queue behind image work
     
     # ML Models
     models_dir: str = "models"
     gpu_enabled: bool = False
+    ml_precision: Literal["fp32", "fp16", "int8"] = "fp16"  # fp16: CUDA only; int8: CPU with VNNI (ONNX Runtime), fp16 on CUDA
     batch_size: int = 4
+    ml_batch_window_ms: float = 5.0  # How long the SR batcher waits for more tiles before a forward pass
+    ml_threads: int = min(8, os.cpu_count() or 1)  # Size of the default executor behind asyncio.to_thread
+    precompute_concurrency: int = 4
     
     # Tile Configuration
     tile_size: int = 512
+    source_image_cache_mb: int = 2048  # Source images kept for dynamic tiling (LRU, by encoded or pixel bytes)
+    source_disk_cache_dir: Optional[str] = "/var/cache/deepzoomer"  # Shared by all workers, survives restarts; None disables
+    source_disk_cache_mb: int = 16384
     max_zoom: int = 20
     cache_ttl: int = 3600  # 1 hour
+    tile_batch_window_ms: float = 2.0  # Tile cache reads/writes arriving this close together share one round-trip
+    
+    # Server
+    # Uvicorn worker processes (ignored when debug reloads); follows WEB_CONCURRENCY, which the uvicorn CLI reads too
+    workers: int = int(os.environ.get("WEB_CONCURRENCY") or max(1, (os.cpu_count() or 2) // 2))
     
     # NASA API
     nasa_api_key: Optional[str] = None
@@ -32,6 +52,11 @@ class Settings(BaseSettings):
     debug: bool = False
     log_level: str = "INFO"
     
+    @property
+    def server_workers(self) -> int:
+        """Worker processes actually started: debug reloading runs a single one"""
+        return 1 if self.debug else self.workers
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -1,18 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, FileResponse, JSONResponse
+from fastapi.responses import Response, FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
 from typing import Optional, Dict, Any
 import asyncio
 import logging
+import math
+import re
 import traceback
 
-from .services.tile_service import TileService
-from .services.ml_service import MLService
-from .services.cache_service import CacheService
-from .services.annotation_service import AnnotationService
+from .services.tile_service import tile_service
+from .services.ml_service import ml_service
+from .services.cache_service import cache_service
+from .services.annotation_service import annotation_service
+from .services.inference_store import inference_store
+from .services.cache_backends import (
+    tile_cache, tile_cache_key, tile_etag, etag_matches, negotiate_tile_format, TILE_MEDIA_TYPES
+)
 from .models.database import get_db
 from .api.routes import tiles, metadata, annotations, ml_inference
 from .config import settings
@@ -24,7 +30,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="NASA Deep Zoom AI Platform",
     description="AI-enhanced deep zoom platform for NASA imagery with ML-powered super-resolution, denoising, and feature detection",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -40,16 +47,87 @@ app.add_middleware(
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Global error: {str(exc)}")
     logger.error(traceback.format_exc())
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "Internal Server Error", "msg": str(exc)},
     )
 
-# Initialize services
-tile_service = TileService()
-ml_service = MLService()
-cache_service = CacheService()
-annotation_service = AnnotationService()
+# Static tile path served straight from the tile cache on a hit
+TILE_PATH = re.compile(r"^/api/tiles/(?P<image_id>[^/]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)$")
+TRUE_VALUES = ("1", "true", "on", "yes")
+FALSE_VALUES = ("0", "false", "off", "no")
+
+def _query_bool(value: Optional[str], default: bool) -> Optional[bool]:
+    """Parse a boolean query param the way FastAPI does; None means invalid"""
+    if value is None:
+        return default
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    return None
+
+@app.middleware("http")
+async def tile_cache_middleware(request: Request, call_next):
+    """
+    Short-circuit static tile GETs before routing: revalidations matching the tile's ETag get a 304
+    with no cache read at all, and cache hits cost one read and never reach the route.
+    """
+    match = TILE_PATH.match(request.url.path) if request.method == "GET" else None
+    if not match:
+        return await call_next(request)
+    
+    if tile_service.is_known_missing(match["image_id"], int(match["z"]), int(match["x"]), int(match["y"])):
+        # No cache read for a tile known to exist nowhere; the route answers 404 straight away
+        return await call_next(request)
+    
+    params = request.query_params
+    enhance = _query_bool(params.get("enhance"), False)
+    labels = _query_bool(params.get("labels"), False)
+    try:
+        confidence_threshold = float(params.get("confidence_threshold", 0.5))
+    except ValueError:
+        confidence_threshold = None
+    if confidence_threshold is not None and not (math.isfinite(confidence_threshold) and 0.0 <= confidence_threshold <= 1.0):
+        # nan/inf cannot be keyed; out-of-range values are the route's 422 as well
+        confidence_threshold = None
+    if enhance is None or labels is None or confidence_threshold is None:
+        # Let the route produce the validation error
+        return await call_next(request)
+    
+    format = negotiate_tile_format(request.headers.get("accept"))
+    cache_key = tile_cache_key(
+        match["image_id"], int(match["z"]), int(match["x"]), int(match["y"]),
+        enhance, labels, confidence_threshold, format
+    )
+    etag = tile_etag(cache_key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "public, max-age=3600", "Vary": "Accept"})
+    
+    if not enhance and not labels and format == "jpeg" and tile_service.passthrough_tile_path(
+        match["image_id"], int(match["z"]), int(match["x"]), int(match["y"])
+    ):
+        # The route sendfiles the source JPEG and never caches it, so a lookup here would always miss
+        return await call_next(request)
+    
+    tile_data, tier = await tile_cache.lookup(cache_key)
+    if tile_data:
+        return Response(
+            content=tile_data,
+            media_type=TILE_MEDIA_TYPES[format],
+            headers={
+                "Cache-Control": "public, max-age=3600",
+                "ETag": etag,
+                "Vary": "Accept",
+                "X-Tile-Enhanced": str(enhance),
+                "X-Tile-Labels": str(labels),
+                "X-Cache": f"HIT-{tier}"
+            }
+        )
+    
+    response = await call_next(request)
+    response.headers["X-Cache"] = "MISS"
+    return response
 
 # Include API routes
 app.include_router(tiles.router, prefix="/api/tiles", tags=["tiles"])
@@ -64,21 +142,37 @@ async def startup_event():
     
     # Initialize ML models
     await ml_service.initialize_models()
+    ml_service.warm_up()
     logger.info("ML models initialized")
     
     # Initialize cache
     await cache_service.initialize()
+    tile_cache.initialize()
     logger.info("Cache service initialized")
     
     # Initialize database
     await annotation_service.initialize()
     logger.info("Annotation service initialized")
+    
+    # Start batched persistence of inference results
+    await inference_store.initialize()
+    
+    # Worker processes for CPU-bound tile precomputation
+    tile_service.start_process_pool()
+    tile_service.source_disk_cache.initialize()
+    
+    # Keep the serialized /api/ml/models/status payload fresh in the background
+    app.state.models_status_task = asyncio.create_task(ml_inference.refresh_models_status())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down NASA Deep Zoom AI Platform...")
+    app.state.models_status_task.cancel()
     await cache_service.close()
+    await tile_service.close()
+    await inference_store.close()
+    await annotation_service.close()
     await ml_service.cleanup()
 
 @app.get("/")
@@ -92,22 +186,26 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {
+    return ORJSONResponse({
         "status": "healthy",
         "ml_service": await ml_service.health_check(),
         "cache_service": await cache_service.health_check(),
         "annotation_service": await annotation_service.health_check()
-    }
+    })
 
 # Mount static files for serving tiles
 if os.path.exists("tiles"):
     app.mount("/tiles", StaticFiles(directory="tiles"), name="tiles")
 
 if __name__ == "__main__":
+    # Run from the repository root with `python -m backend.main`
     uvicorn.run(
-        "main:app",
+        "backend.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        workers=settings.server_workers,
+        loop="uvloop",
+        http="httptools",
+        reload=settings.debug,
         log_level="info"
     )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Float, JSON, Text, Integer
+from sqlalchemy import Column, String, DateTime, Float, JSON, Text, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from .database import Base
@@ -6,10 +6,18 @@ import uuid
 
 class Annotation(Base):
     __tablename__ = "annotations"
+    __table_args__ = (
+        Index("ix_annotations_image_type_confidence", "image_id", "annotation_type", "confidence"),
+        Index("ix_annotations_image_zxy", "image_id", "z", "x", "y"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     image_id = Column(String, nullable=False, index=True)
     tile_coordinates = Column(JSON, nullable=False)  # {"z": 10, "x": 100, "y": 50}
+    # Tile coordinates promoted out of the JSON so tile lookups hit a btree index
+    z = Column(Integer, nullable=True)
+    x = Column(Integer, nullable=True)
+    y = Column(Integer, nullable=True)
     annotation_type = Column(String, nullable=False)  # "crater", "lava_flow", "dust_storm", etc.
     geometry = Column(JSON, nullable=False)  # {"type": "Polygon", "coordinates": [...]}
     properties = Column(JSON, nullable=True)  # Additional properties
@@ -20,6 +28,9 @@ class Annotation(Base):
 
 class TileMetadata(Base):
     __tablename__ = "tile_metadata"
+    __table_args__ = (
+        Index("ix_tile_metadata_image_zxy", "image_id", "z", "x", "y"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     image_id = Column(String, nullable=False, index=True)
@@ -52,6 +63,9 @@ class ImageMetadata(Base):
 
 class UserFeedback(Base):
     __tablename__ = "user_feedback"
+    __table_args__ = (
+        Index("ix_user_feedback_image_type", "image_id", "feedback_type"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     image_id = Column(String, nullable=False, index=True)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
@@ -28,6 +28,9 @@ class Annotation(AnnotationBase):
     class Config:
         from_attributes = True
 
+# Compiled list validators/serializers for bulk annotation responses
+AnnotationList = TypeAdapter(List[Annotation])
+
 class TileMetadataBase(BaseModel):
     image_id: str
     z: int
@@ -89,6 +92,17 @@ class UserFeedback(UserFeedbackBase):
     class Config:
         from_attributes = True
 
+class FeedbackItem(BaseModel):
+    id: str
+    feedback_type: str
+    content: str
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+FeedbackItemList = TypeAdapter(List[FeedbackItem])
+
 class MLInferenceRequest(BaseModel):
     image_id: str
     z: int
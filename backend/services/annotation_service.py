@@ -1,17 +1,27 @@
 import asyncio
 import json
 import logging
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import List, Dict, Any, Optional, AsyncIterator
+from datetime import datetime, timezone
 import uuid
+import orjson
 
 from ..models.database import get_db
-from ..models.schemas import Annotation, AnnotationCreate, AnnotationUpdate
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from ..models.models import Annotation
+from ..models.schemas import AnnotationCreate, AnnotationUpdate
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, select, func, insert, update, delete, inspect, text
+from sqlalchemy.orm import raiseload
 
 logger = logging.getLogger(__name__)
 
+# Supported export formats and rows fetched per cursor round-trip while streaming
+EXPORT_FORMATS = ("json", "coco")
+EXPORT_PARTITION_SIZE = 1000
+
+# PostgreSQL advisory lock key taken around startup DDL, so concurrent workers apply it one at a time
+SCHEMA_LOCK_KEY = 0x44_5A_53_43  # "DZSC"
+
 class AnnotationService:
     def __init__(self):
         self.initialized = False
@@ -23,8 +33,14 @@ class AnnotationService:
             from ..models.database import engine
             from ..models import models
             
-            # Create tables
-            models.Base.metadata.create_all(bind=engine)
+            # Create tables, then any columns and indexes added to tables that already existed
+            async with engine.begin() as conn:
+                if conn.dialect.name == "postgresql":
+                    # Held until commit: later workers inspect the schema only after the first one finished
+                    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+                await conn.run_sync(models.Base.metadata.create_all)
+                await conn.run_sync(self._add_tile_columns)
+                await conn.run_sync(self._create_missing_indexes, models.Base.metadata)
             self.initialized = True
             logger.info("Annotation service initialized")
             
@@ -32,158 +48,252 @@ class AnnotationService:
             logger.error(f"Error initializing annotation service: {str(e)}")
             raise
     
+    @staticmethod
+    def _add_tile_columns(connection):
+        """Add the integer z/x/y columns to an existing annotations table and backfill them from the JSON"""
+        existing = {column["name"] for column in inspect(connection).get_columns(Annotation.__tablename__)}
+        missing = [Annotation.__table__.c[name] for name in ("z", "x", "y") if name not in existing]
+        if not missing:
+            return
+        
+        # Belt and braces next to the advisory lock; SQLite has no IF NOT EXISTS for columns
+        if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+        for column in missing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {Annotation.__tablename__} ADD COLUMN {if_not_exists}{column.name} {column_type}"
+            ))
+        connection.execute(
+            update(Annotation.__table__).values(
+                z=Annotation.tile_coordinates["z"].as_integer(),
+                x=Annotation.tile_coordinates["x"].as_integer(),
+                y=Annotation.tile_coordinates["y"].as_integer()
+            )
+        )
+        logger.info("Backfilled annotation tile columns")
+    
+    @staticmethod
+    def _create_missing_indexes(connection, metadata):
+        """create_all() skips existing tables, so create their declared indexes individually"""
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    
     async def create_annotation(
         self, 
         annotation_data: AnnotationCreate,
-        db: Session
+        db: AsyncSession
     ) -> Annotation:
         """Create a new annotation"""
         try:
+            now = datetime.now(timezone.utc)
             annotation = Annotation(
                 id=str(uuid.uuid4()),
                 image_id=annotation_data.image_id,
                 tile_coordinates=annotation_data.tile_coordinates,
+                z=annotation_data.tile_coordinates.get("z"),
+                x=annotation_data.tile_coordinates.get("x"),
+                y=annotation_data.tile_coordinates.get("y"),
                 annotation_type=annotation_data.annotation_type,
                 geometry=annotation_data.geometry,
                 properties=annotation_data.properties,
                 confidence=annotation_data.confidence,
                 user_id=annotation_data.user_id,
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
+                created_at=now,
+                updated_at=now
             )
             
             db.add(annotation)
-            db.commit()
-            db.refresh(annotation)
+            await db.commit()
+            await db.refresh(annotation)
             
             logger.info(f"Created annotation {annotation.id}")
             return annotation
             
         except Exception as e:
             logger.error(f"Error creating annotation: {str(e)}")
-            db.rollback()
+            await db.rollback()
+            raise
+    
+    async def create_annotations_bulk(
+        self,
+        items: List[AnnotationCreate],
+        db: AsyncSession
+    ) -> List[str]:
+        """Create many annotations with one multi-row INSERT and a single commit, returning their IDs"""
+        try:
+            now = datetime.now(timezone.utc)
+            rows = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "image_id": item.image_id,
+                    "tile_coordinates": item.tile_coordinates,
+                    "z": item.tile_coordinates.get("z"),
+                    "x": item.tile_coordinates.get("x"),
+                    "y": item.tile_coordinates.get("y"),
+                    "annotation_type": item.annotation_type,
+                    "geometry": item.geometry,
+                    "properties": item.properties,
+                    "confidence": item.confidence,
+                    "user_id": item.user_id,
+                    "created_at": now,
+                    "updated_at": now
+                }
+                for item in items
+            ]
+            if not rows:
+                return []
+            
+            await db.execute(insert(Annotation), rows)
+            await db.commit()
+            
+            logger.info(f"Created {len(rows)} annotations")
+            return [row["id"] for row in rows]
+            
+        except Exception as e:
+            logger.error(f"Error creating annotations in bulk: {str(e)}")
+            await db.rollback()
             raise
     
     async def get_annotations(
         self, 
         image_id: str, 
-        db: Session,
+        db: AsyncSession,
         z: Optional[int] = None, 
         x: Optional[int] = None, 
-        y: Optional[int] = None
+        y: Optional[int] = None,
+        annotation_type: Optional[str] = None,
+        min_confidence: Optional[float] = None
     ) -> List[Annotation]:
-        """Get annotations for an image or specific tile"""
+        """Get annotations for an image or specific tile, optionally filtered by type and confidence"""
         try:
-            query = db.query(Annotation).filter(Annotation.image_id == image_id)
+            # Annotations have no relationships yet; refuse lazy loads so any added
+            # later must be eager-loaded here instead of issuing a SELECT per row
+            query = select(Annotation).options(raiseload("*")).where(Annotation.image_id == image_id)
+            
+            if annotation_type:
+                query = query.where(Annotation.annotation_type == annotation_type)
+            
+            if min_confidence is not None:
+                query = query.where(Annotation.confidence >= min_confidence)
             
             if z is not None and x is not None and y is not None:
-                # Filter by tile coordinates - check if using SQLite or Postgres
-                from ..models.database import engine
-                if engine.url.drivername == 'sqlite':
-                    # SQLite: fetch all and filter in memory OR use json_extract (standard SQLAlchemy handles this poorly across versions)
-                    annotations = query.all()
-                    return [
-                        a for a in annotations 
-                        if str(a.tile_coordinates.get('z')) == str(z) and 
-                           str(a.tile_coordinates.get('x')) == str(x) and 
-                           str(a.tile_coordinates.get('y')) == str(y)
-                    ]
-                else:
-                    # Postgres-specific JSON filtering
-                    query = query.filter(
-                        and_(
-                            Annotation.tile_coordinates['z'].astext == str(z),
-                            Annotation.tile_coordinates['x'].astext == str(x),
-                            Annotation.tile_coordinates['y'].astext == str(y)
-                        )
+                # Filter by tile coordinates on the indexed integer columns
+                query = query.where(
+                    and_(
+                        Annotation.z == z,
+                        Annotation.x == x,
+                        Annotation.y == y
                     )
+                )
             
-            return query.all()
+            return (await db.execute(query)).scalars().all()
             
         except Exception as e:
             logger.error(f"Error getting annotations: {str(e)}")
-            return []
+            # Raised, not swallowed: the cached routes must not store a DB failure as an empty result
+            raise
     
     async def update_annotation(
         self, 
         annotation_id: str, 
         update_data: AnnotationUpdate,
-        db: Session
+        db: AsyncSession
     ) -> Optional[Annotation]:
-        """Update an annotation"""
+        """Update an annotation in a single UPDATE ... RETURNING round-trip"""
         try:
-            annotation = db.query(Annotation).filter(Annotation.id == annotation_id).first()
+            values = update_data.dict(exclude_unset=True)
+            values["updated_at"] = datetime.now(timezone.utc)
+            
+            result = await db.execute(
+                update(Annotation)
+                .where(Annotation.id == annotation_id)
+                .values(**values)
+                .returning(Annotation)
+            )
+            annotation = result.scalar_one_or_none()
             if not annotation:
                 return None
             
-            # Update fields
-            for field, value in update_data.dict(exclude_unset=True).items():
-                setattr(annotation, field, value)
-            
-            annotation.updated_at = datetime.utcnow()
-            
-            db.commit()
-            db.refresh(annotation)
+            await db.commit()
             
             logger.info(f"Updated annotation {annotation_id}")
             return annotation
             
         except Exception as e:
             logger.error(f"Error updating annotation: {str(e)}")
-            db.rollback()
+            await db.rollback()
             return None
     
-    async def delete_annotation(self, annotation_id: str, db: Session) -> bool:
-        """Delete an annotation"""
+    async def delete_annotation(self, annotation_id: str, db: AsyncSession) -> Optional[str]:
+        """Delete an annotation, returning the ID of the image it belonged to"""
         try:
-            annotation = db.query(Annotation).filter(Annotation.id == annotation_id).first()
-            if not annotation:
-                return False
+            result = await db.execute(
+                delete(Annotation)
+                .where(Annotation.id == annotation_id)
+                .returning(Annotation.image_id)
+            )
+            image_id = result.scalar_one_or_none()
+            if not image_id:
+                return None
             
-            db.delete(annotation)
-            db.commit()
+            await db.commit()
             
             logger.info(f"Deleted annotation {annotation_id}")
-            return True
+            return image_id
             
         except Exception as e:
             logger.error(f"Error deleting annotation: {str(e)}")
-            db.rollback()
-            return False
+            await db.rollback()
+            return None
     
-    async def get_annotation_stats(self, image_id: str, db: Session) -> Dict[str, Any]:
+    async def get_annotation_stats(self, image_id: str, db: AsyncSession) -> Dict[str, Any]:
         """Get annotation statistics for an image"""
         try:
-            total_annotations = db.query(Annotation).filter(Annotation.image_id == image_id).count()
+            # One GROUP BY pass served from the (image_id, annotation_type, confidence) index;
+            # image-wide figures are folded from the per-type partials (portable, unlike ROLLUP on SQLite)
+            type_rows = (await db.execute(
+                select(
+                    Annotation.annotation_type,
+                    func.count(),
+                    func.count(Annotation.confidence),
+                    func.sum(Annotation.confidence),
+                    func.min(Annotation.confidence),
+                    func.max(Annotation.confidence)
+                )
+                .where(Annotation.image_id == image_id)
+                .group_by(Annotation.annotation_type)
+            )).all()
             
-            # Count by type
-            type_counts = {}
-            annotations = db.query(Annotation).filter(Annotation.image_id == image_id).all()
-            for annotation in annotations:
-                annotation_type = annotation.annotation_type
-                type_counts[annotation_type] = type_counts.get(annotation_type, 0) + 1
+            type_counts = {row[0]: row[1] for row in type_rows}
+            total_annotations = sum(type_counts.values())
             
-            # Average confidence
-            confidences = [a.confidence for a in annotations if a.confidence is not None]
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+            # Confidence aggregates skip NULL confidences
+            confidence_count = sum(row[2] for row in type_rows)
+            confidence_sum = sum(row[3] or 0 for row in type_rows)
+            mins = [row[4] for row in type_rows if row[4] is not None]
+            maxes = [row[5] for row in type_rows if row[5] is not None]
+            avg_confidence = confidence_sum / confidence_count if confidence_count else 0
+            min_confidence = min(mins) if mins else 0
+            max_confidence = max(maxes) if maxes else 0
             
             return {
                 "total_annotations": total_annotations,
                 "type_counts": type_counts,
-                "average_confidence": avg_confidence,
+                "average_confidence": float(avg_confidence),
                 "confidence_range": {
-                    "min": min(confidences) if confidences else 0,
-                    "max": max(confidences) if confidences else 0
+                    "min": min_confidence or 0,
+                    "max": max_confidence or 0
                 }
             }
             
         except Exception as e:
             logger.error(f"Error getting annotation stats: {str(e)}")
-            return {}
+            raise
     
     async def search_annotations(
         self, 
-        db: Session,
+        db: AsyncSession,
         query: str, 
         image_id: Optional[str] = None,
         annotation_type: Optional[str] = None,
@@ -191,103 +301,113 @@ class AnnotationService:
     ) -> List[Annotation]:
         """Search annotations with filters"""
         try:
-            query_obj = db.query(Annotation)
+            query_obj = select(Annotation).options(raiseload("*"))
             
             if image_id:
-                query_obj = query_obj.filter(Annotation.image_id == image_id)
+                query_obj = query_obj.where(Annotation.image_id == image_id)
             
             if annotation_type:
-                query_obj = query_obj.filter(Annotation.annotation_type == annotation_type)
+                query_obj = query_obj.where(Annotation.annotation_type == annotation_type)
             
             if min_confidence is not None:
-                query_obj = query_obj.filter(Annotation.confidence >= min_confidence)
+                query_obj = query_obj.where(Annotation.confidence >= min_confidence)
             
             # Text search in properties
             if query:
-                query_obj = query_obj.filter(
+                query_obj = query_obj.where(
                     Annotation.properties.ilike(f"%{query}%")
                 )
             
-            annotations = query_obj.all()
+            annotations = (await db.execute(query_obj)).scalars().all()
             return annotations
             
         except Exception as e:
             logger.error(f"Error searching annotations: {str(e)}")
             return []
     
-    async def export_annotations(
+    async def stream_export(
         self, 
         image_id: str, 
-        db: Session,
+        db: AsyncSession,
         format: str = "json"
-    ) -> Dict[str, Any]:
-        """Export annotations in various formats"""
-        try:
-            annotations = await self.get_annotations(image_id, db=db)
-            
-            if format == "json":
-                return {
-                    "image_id": image_id,
-                    "annotations": [
-                        {
-                            "id": a.id,
-                            "type": a.annotation_type,
-                            "geometry": a.geometry,
-                            "properties": a.properties,
-                            "confidence": a.confidence,
-                            "created_at": a.created_at.isoformat(),
-                            "updated_at": a.updated_at.isoformat()
-                        }
-                        for a in annotations
-                    ]
-                }
-            elif format == "coco":
-                # Convert to COCO format
-                return self._convert_to_coco(annotations, image_id)
-            else:
-                raise ValueError(f"Unsupported format: {format}")
-                
-        except Exception as e:
-            logger.error(f"Error exporting annotations: {str(e)}")
-            return {}
+    ) -> AsyncIterator[bytes]:
+        """
+        Export annotations in various formats, streamed as JSON byte chunks.
+        Rows are read from a server-side cursor so memory stays bounded by one partition,
+        and only the exported columns are selected so no ORM entities are built.
+        """
+        query = (
+            select(
+                Annotation.id,
+                Annotation.annotation_type,
+                Annotation.geometry,
+                Annotation.properties,
+                Annotation.confidence,
+                Annotation.created_at,
+                Annotation.updated_at
+            )
+            .where(Annotation.image_id == image_id)
+            .execution_options(yield_per=EXPORT_PARTITION_SIZE)
+        )
+        result = await db.stream(query)
+        
+        if format == "coco":
+            async for chunk in self._stream_coco(result, image_id):
+                yield chunk
+            return
+        
+        yield b'{"image_id":' + orjson.dumps(image_id) + b',"annotations":['
+        separator = b""
+        async for partition in result.partitions():
+            rows = [
+                orjson.dumps({
+                    "id": a.id,
+                    "type": a.annotation_type,
+                    "geometry": a.geometry,
+                    "properties": a.properties,
+                    "confidence": a.confidence,
+                    "created_at": a.created_at.isoformat(),
+                    "updated_at": a.updated_at.isoformat()
+                })
+                for a in partition
+            ]
+            yield separator + b",".join(rows)
+            separator = b","
+        yield b"]}"
     
-    def _convert_to_coco(self, annotations: List[Annotation], image_id: str) -> Dict[str, Any]:
-        """Convert annotations to COCO format"""
-        try:
-            coco_data = {
-                "images": [{"id": 1, "file_name": f"{image_id}.jpg"}],
-                "annotations": [],
-                "categories": []
-            }
-            
-            category_map = {}
-            for i, annotation in enumerate(annotations):
+    async def _stream_coco(self, annotations, image_id: str) -> AsyncIterator[bytes]:
+        """Stream annotations in COCO format; categories are emitted once every row has been seen"""
+        images = [{"id": 1, "file_name": f"{image_id}.jpg"}]
+        yield b'{"images":' + orjson.dumps(images) + b',"annotations":['
+        
+        category_map = {}
+        index = 0
+        separator = b""
+        async for partition in annotations.partitions():
+            rows = []
+            for annotation in partition:
+                index += 1
                 # Add category if not exists
                 if annotation.annotation_type not in category_map:
-                    category_id = len(category_map) + 1
-                    category_map[annotation.annotation_type] = category_id
-                    coco_data["categories"].append({
-                        "id": category_id,
-                        "name": annotation.annotation_type
-                    })
+                    category_map[annotation.annotation_type] = len(category_map) + 1
                 
                 # Convert geometry to COCO bbox format
                 if annotation.geometry and "bbox" in annotation.geometry:
                     bbox = annotation.geometry["bbox"]
-                    coco_data["annotations"].append({
-                        "id": i + 1,
+                    rows.append(orjson.dumps({
+                        "id": index,
                         "image_id": 1,
                         "category_id": category_map[annotation.annotation_type],
                         "bbox": bbox,
                         "area": bbox[2] * bbox[3],
                         "iscrowd": 0
-                    })
-            
-            return coco_data
-            
-        except Exception as e:
-            logger.error(f"Error converting to COCO format: {str(e)}")
-            return {}
+                    }))
+            if rows:
+                yield separator + b",".join(rows)
+                separator = b","
+        
+        categories = [{"id": category_id, "name": name} for name, category_id in category_map.items()]
+        yield b'],"categories":' + orjson.dumps(categories) + b"}"
     
     async def health_check(self) -> Dict[str, Any]:
         """Check annotation service health"""
@@ -299,3 +419,16 @@ class AnnotationService:
         except Exception as e:
             logger.error(f"Annotation service health check failed: {str(e)}")
             return {"status": "unhealthy", "error": str(e)}
+    
+    async def close(self):
+        """Dispose the database engine and its connection pool"""
+        try:
+            from ..models.database import engine
+            await engine.dispose()
+            self.initialized = False
+            logger.info("Annotation service closed")
+        except Exception as e:
+            logger.error(f"Error closing annotation service: {str(e)}")
+
+# Global instance
+annotation_service = AnnotationService()
@@ -0,0 +1,335 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import xxhash
+
+from ..config import settings
+from .cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the keys coalesced into one MGET / pipeline before flushing early
+TILE_BATCH_MAX_KEYS = 256
+
+# Encodings a tile can be served in, keyed by the format name used in cache keys
+TILE_MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+def negotiate_tile_format(accept: Optional[str]) -> str:
+    """Serve WebP to clients that advertise it, JPEG to everyone else"""
+    return "webp" if accept and "image/webp" in accept else "jpeg"
+
+def _format_suffix(format: str) -> str:
+    # JPEG, the default encoding, carries no suffix
+    return "" if format == "jpeg" else f":{format}"
+
+def _params_segment(enhance: bool, labels: bool, confidence_threshold: float) -> str:
+    # Compact rendering flags, e.g. "e1l0c0.5": key bytes add up across millions of tiles in Redis.
+    # The threshold is keyed exactly, as add_labels draws with it unrounded
+    return f"e{int(enhance)}l{int(labels)}c{float(confidence_threshold)!r}"
+
+def tile_cache_key(
+    image_id: str,
+    z: int,
+    x: int,
+    y: int,
+    enhance: bool = False,
+    labels: bool = False,
+    confidence_threshold: float = 0.5,
+    format: str = "jpeg"
+) -> str:
+    """
+    Build the cache key for a static tile from the parameters that change its bytes.
+    Client-only parameters (e.g. chunked) are deliberately left out.
+    """
+    return f"{image_id}:{z}:{x}:{y}:" + _params_segment(enhance, labels, confidence_threshold) + _format_suffix(format)
+
+def dynamic_tile_cache_key(
+    image_url: str,
+    z: int,
+    x: int,
+    y: int,
+    enhance: bool = False,
+    labels: bool = False,
+    confidence_threshold: float = 0.5,
+    quality: int = 90,
+    format: str = "jpeg"
+) -> str:
+    """Build the cache key for a tile cropped on the fly from an external image URL"""
+    # Non-cryptographic XXH3: keys only need to be stable, and this runs on every proxy tile request
+    url_hash = xxhash.xxh3_64_hexdigest(image_url)
+    return (
+        f"dyn:{url_hash}:{z}:{x}:{y}:" + _params_segment(enhance, labels, confidence_threshold)
+        + f"q{quality}" + _format_suffix(format)
+    )
+
+def tile_etag(cache_key: str) -> str:
+    """Strong ETag for a tile; a cache key always maps to the same bytes"""
+    return '"' + xxhash.xxh3_64_hexdigest(cache_key) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value covers `etag`"""
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, f"W/{etag}", "*") for tag in if_none_match.split(","))
+
+class TileBatcher:
+    """
+    Coalesce single-tile cache reads and writes arriving within `tile_batch_window_ms` into one
+    MGET / one pipeline. A viewport change in OpenSeadragon fires 10-30 tile requests at once,
+    which would otherwise pay a Redis round-trip each.
+    """
+    def __init__(self, cache_service):
+        self.cache_service = cache_service
+        self.window = settings.tile_batch_window_ms / 1000
+        self._reads: Dict[str, List[asyncio.Future]] = {}
+        self._read_timer: Optional[asyncio.TimerHandle] = None
+        self._writes: Dict[Optional[int], Dict[str, bytes]] = {}
+        self._write_waiters: List[asyncio.Future] = []
+        self._write_timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()  # Strong references to in-flight flush tasks
+
+    async def get(self, key: str) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Concurrent requests for the same tile share one slot in the MGET
+        self._reads.setdefault(key, []).append(future)
+        if len(self._reads) >= TILE_BATCH_MAX_KEYS:
+            self._flush_reads()
+        elif self._read_timer is None:
+            self._read_timer = loop.call_later(self.window, self._flush_reads)
+        return await future
+
+    async def set(self, key: str, data: bytes, ttl: int = None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.setdefault(ttl, {})[key] = data
+        self._write_waiters.append(future)
+        if len(self._write_waiters) >= TILE_BATCH_MAX_KEYS:
+            self._flush_writes()
+        elif self._write_timer is None:
+            self._write_timer = loop.call_later(self.window, self._flush_writes)
+        await future
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _flush_reads(self):
+        if self._read_timer is not None:
+            self._read_timer.cancel()
+            self._read_timer = None
+        reads, self._reads = self._reads, {}
+        if reads:
+            self._spawn(self._resolve_reads(reads))
+
+    def _flush_writes(self):
+        if self._write_timer is not None:
+            self._write_timer.cancel()
+            self._write_timer = None
+        writes, self._writes = self._writes, {}
+        waiters, self._write_waiters = self._write_waiters, []
+        if waiters:
+            self._spawn(self._resolve_writes(writes, waiters))
+
+    async def _resolve_reads(self, reads: Dict[str, List[asyncio.Future]]):
+        keys = list(reads)
+        try:
+            values = await self.cache_service.get_tiles(keys)
+        except Exception as e:
+            logger.error(f"Error in batched tile read: {str(e)}")
+            values = [None] * len(keys)
+        for key, value in zip(keys, values):
+            for future in reads[key]:
+                if not future.done():
+                    future.set_result(value)
+
+    async def _resolve_writes(self, writes: Dict[Optional[int], Dict[str, bytes]], waiters: List[asyncio.Future]):
+        try:
+            # One pipeline per distinct TTL; in practice every tile uses the default
+            for ttl, items in writes.items():
+                await self.cache_service.set_tiles(items, ttl)
+        except Exception as e:
+            logger.error(f"Error in batched tile write: {str(e)}")
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+class RedisBackend:
+    """Hot tier: the shared Redis connection pool (with its in-memory fallback)"""
+    def __init__(self):
+        self.cache_service = cache_service
+        self.batcher = TileBatcher(cache_service)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.cache_service.connected:
+            # The memory fallback has no round-trip worth saving
+            return await self.cache_service.get_tile(key)
+        return await self.batcher.get(key)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self.cache_service.get_tiles(keys)
+
+    async def set(self, key: str, data: bytes, ttl: int = None):
+        if not self.cache_service.connected:
+            await self.cache_service.set_tile(key, data, ttl)
+            return
+        await self.batcher.set(key, data, ttl)
+
+    async def set_many(self, items: Dict[str, bytes], ttl: int = None):
+        await self.cache_service.set_tiles(items, ttl)
+
+    async def invalidate_image(self, image_id: str):
+        """Delete every tile of an image through the `tiles:{image_id}` index set"""
+        await self.cache_service.invalidate_image(image_id)
+
+class S3Backend:
+    """
+    Warm tier: tile blobs in S3 under `settings.s3_cache_prefix`.
+    Disabled unless `settings.s3_bucket` is set; expiry is left to the bucket's lifecycle rules.
+    """
+    def __init__(self):
+        self.bucket = settings.s3_bucket
+        self.prefix = settings.s3_cache_prefix
+        self.client = None
+        self.executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None
+
+    def initialize(self):
+        """Create the boto3 client if a bucket is configured"""
+        if not self.bucket:
+            return
+        try:
+            import boto3
+            from botocore.config import Config
+            self.client = boto3.client(
+                "s3",
+                region_name=settings.aws_region,
+                aws_access_key_id=settings.aws_access_key_id,
+                aws_secret_access_key=settings.aws_secret_access_key,
+                config=Config(max_pool_connections=settings.s3_io_threads)
+            )
+            # Blocking network calls stay out of the bounded default executor used for image work
+            self.executor = ThreadPoolExecutor(max_workers=settings.s3_io_threads, thread_name_prefix="s3")
+            logger.info(f"S3 tile cache enabled on bucket {self.bucket}")
+        except Exception as e:
+            logger.error(f"Error initializing S3 tile cache: {str(e)}")
+            self.client = None
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        try:
+            return await self._run(self._get_sync, self.prefix + key)
+        except Exception as e:
+            logger.error(f"Error getting tile from S3: {str(e)}")
+            return None
+
+    def _get_sync(self, object_key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=object_key)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    async def set(self, key: str, data: bytes, ttl: int = None):
+        if not self.enabled:
+            return
+        try:
+            await self._run(
+                self.client.put_object,
+                Bucket=self.bucket,
+                Key=self.prefix + key,
+                Body=data
+            )
+        except Exception as e:
+            logger.error(f"Error setting tile in S3: {str(e)}")
+
+    async def set_many(self, items: Dict[str, bytes], ttl: int = None):
+        # S3 has no batch put; the uploads at least run concurrently
+        if self.enabled:
+            await asyncio.gather(*(self.set(key, data, ttl) for key, data in items.items()))
+
+    async def invalidate_image(self, image_id: str):
+        """Delete every tile object stored for an image"""
+        if not self.enabled:
+            return
+        try:
+            deleted = await self._run(self._invalidate_sync, f"{self.prefix}{image_id}:")
+            if deleted:
+                logger.info(f"Invalidated {deleted} S3 tile objects for image {image_id}")
+        except Exception as e:
+            logger.error(f"Error invalidating S3 tiles: {str(e)}")
+
+    def _invalidate_sync(self, prefix: str) -> int:
+        deleted = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                # list_objects_v2 pages hold at most 1000 keys, the delete_objects limit
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+                deleted += len(objects)
+        return deleted
+
+class TileCache:
+    """Two-tier tile cache: Redis first, then S3, promoting S3 hits back into Redis"""
+    def __init__(self):
+        self.redis = RedisBackend()
+        self.s3 = S3Backend()
+
+    def initialize(self):
+        self.s3.initialize()
+
+    async def lookup(self, key: str) -> Tuple[Optional[bytes], str]:
+        """Return (tile bytes, tier) where tier is 'redis', 's3' or 'miss'"""
+        data = await self.redis.get(key)
+        if data:
+            return data, "redis"
+
+        data = await self.s3.get(key)
+        if data:
+            await self.redis.set(key, data)
+            return data, "s3"
+
+        return None, "miss"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data, _ = await self.lookup(key)
+        return data
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Look up a batch of tiles with one Redis MGET, falling back to S3 only for the misses"""
+        results = await self.redis.get_many(keys)
+        misses = [i for i, data in enumerate(results) if not data]
+        if misses and self.s3.enabled:
+            fetched = await asyncio.gather(*(self.s3.get(keys[i]) for i in misses))
+            promoted = {}
+            for i, data in zip(misses, fetched):
+                if data:
+                    results[i] = data
+                    promoted[keys[i]] = data
+            if promoted:
+                await self.redis.set_many(promoted)
+        return results
+
+    async def set(self, key: str, data: bytes, ttl: int = None):
+        await asyncio.gather(self.redis.set(key, data, ttl), self.s3.set(key, data, ttl))
+
+    async def set_many(self, items: Dict[str, bytes], ttl: int = None):
+        """Store a batch of tiles in both tiers, pipelined into a single Redis round-trip"""
+        await asyncio.gather(self.redis.set_many(items, ttl), self.s3.set_many(items, ttl))
+
+    async def invalidate_image(self, image_id: str):
+        await asyncio.gather(self.redis.invalidate_image(image_id), self.s3.invalidate_image(image_id))
+
+# Global instance
+tile_cache = TileCache()
@@ -1,30 +1,172 @@
 import redis.asyncio as redis
-import json
+import asyncio
 import logging
-from typing import Optional, Dict, Any
-import hashlib
-import pickle
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+import msgpack
+import zstandard as zstd
 
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Metadata is stored as zstd-compressed msgpack; the contexts are reusable across calls
+_ZSTD_COMPRESSOR = zstd.ZstdCompressor(level=3)
+_ZSTD_DECOMPRESSOR = zstd.ZstdDecompressor()
+
+# Tile payloads that are already encoded images; anything else is zstd-compressed on its way into Redis
+_ENCODED_TILE_MAGIC = (b"\xff\xd8", b"\x89PNG", b"RIFF")
+_ZSTD_FRAME_MAGIC = b"\x28\xb5\x2f\xfd"
+_TILE_COMPRESSOR = zstd.ZstdCompressor(level=1)
+
+# Status hash fields stored as integers; Redis hands every value back as a string
+_STATUS_INT_FIELDS = ("done", "total", "progress")
+
+# Compare-and-delete: drop a lock only while it still holds the releasing owner's token
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+def _pack_tile(tile_data: bytes) -> bytes:
+    """Compress raw (non-JPEG/PNG/WebP) tile bytes; the zstd frame magic marks them for unpacking"""
+    if tile_data.startswith(_ENCODED_TILE_MAGIC):
+        return tile_data
+    return _TILE_COMPRESSOR.compress(tile_data)
+
+def _unpack_tile(cached_data: Optional[bytes]) -> Optional[bytes]:
+    if cached_data and cached_data.startswith(_ZSTD_FRAME_MAGIC):
+        return _ZSTD_DECOMPRESSOR.decompress(cached_data)
+    return cached_data
+
+def tile_index_keys(cache_key: str) -> Optional[Tuple[str, str]]:
+    """
+    Index sets a tile key belongs to: (`tiles:{image_id}`, `tiles:{image_id}:{z}:{x}:{y}`).
+    Tile keys start with `{image_id}:{z}:{x}:{y}`; returns None for anything else, including
+    URL-keyed dynamic tiles, which are never invalidated per image.
+    """
+    parts = cache_key.split(":", 4)
+    if len(parts) < 4 or parts[0] == "dyn":
+        return None
+    image_index = f"tiles:{parts[0]}"
+    return image_index, f"{image_index}:{parts[1]}:{parts[2]}:{parts[3]}"
+
+# Size classes of the memory fallback: (upper bound in bytes, share of the byte budget)
+MEMORY_SLABS = (
+    (64 * 1024, 0.25),
+    (512 * 1024, 0.35),
+    (None, 0.40),
+)
+
+class SlabCache:
+    """
+    Byte-budgeted LRU split into size-classed slabs.
+    A large tile only ever evicts tiles of its own class, so super-resolved tiles
+    cannot flush the many small hot ones.
+    """
+    def __init__(self, byte_limit: int):
+        self.slabs = [
+            {"max_size": max_size, "byte_limit": int(byte_limit * share), "bytes_used": 0, "entries": OrderedDict()}
+            for max_size, share in MEMORY_SLABS
+        ]
+    
+    def _slab_for(self, size: int) -> Dict[str, Any]:
+        return next(slab for slab in self.slabs if slab["max_size"] is None or size < slab["max_size"])
+    
+    def get(self, key: str) -> Optional[bytes]:
+        for slab in self.slabs:
+            data = slab["entries"].get(key)
+            if data is not None:
+                slab["entries"].move_to_end(key)
+                return data
+        return None
+    
+    def set(self, key: str, data: bytes):
+        self.pop(key)
+        slab = self._slab_for(len(data))
+        if len(data) > slab["byte_limit"]:
+            return
+        
+        slab["entries"][key] = data
+        slab["bytes_used"] += len(data)
+        while slab["bytes_used"] > slab["byte_limit"]:
+            _, evicted = slab["entries"].popitem(last=False)
+            slab["bytes_used"] -= len(evicted)
+    
+    def pop(self, key: str):
+        for slab in self.slabs:
+            data = slab["entries"].pop(key, None)
+            if data is not None:
+                slab["bytes_used"] -= len(data)
+    
+    def pop_prefix(self, prefix: str):
+        for slab in self.slabs:
+            for key in [k for k in slab["entries"] if k.startswith(prefix)]:
+                slab["bytes_used"] -= len(slab["entries"].pop(key))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": sum(len(slab["entries"]) for slab in self.slabs),
+            "bytes_used": sum(slab["bytes_used"] for slab in self.slabs),
+            "slabs": [
+                {"max_size": slab["max_size"], "entries": len(slab["entries"]),
+                 "bytes_used": slab["bytes_used"], "byte_limit": slab["byte_limit"]}
+                for slab in self.slabs
+            ]
+        }
+
 class CacheService:
     def __init__(self):
+        self.redis_pool = None
         self.redis_client = None
         self.connected = False
-        self.memory_cache = {} # Fallback for when Redis is unavailable
+        self.initialized = False # Set once initialize() has run, whether or not Redis answered
+        self._init_lock: Optional[asyncio.Lock] = None
+        self.memory_cache = SlabCache(settings.memory_cache_mb * 1024 * 1024) # Fallback for when Redis is unavailable
+        self.status_cache = {} # Fallback for job status records
+        self.lock_cache = {} # Fallback for job locks: key -> (expiry in monotonic seconds, owner token)
+        self._info_cache: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None) # (monotonic fetch time, INFO-derived stats)
         
     async def initialize(self):
         """Initialize Redis connection"""
         try:
-            self.redis_client = redis.from_url(settings.redis_url)
+            # Past the cap, requests queue for a connection instead of failing with "Too many connections"
+            self.redis_pool = redis.BlockingConnectionPool.from_url(
+                settings.redis_url,
+                max_connections=settings.redis_pool_size,
+                timeout=settings.redis_pool_timeout,
+                health_check_interval=30,
+                socket_keepalive=True
+            )
+            self.redis_client = redis.Redis(connection_pool=self.redis_pool)
             await self.redis_client.ping()
+            
+            # Concurrent pings each check out their own connection, pre-opening the sockets
+            await asyncio.gather(*(
+                self.redis_client.ping()
+                for _ in range(min(settings.redis_pool_min, settings.redis_pool_size))
+            ))
             self.connected = True
             logger.info("Cache service initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing cache service: {str(e)}")
             self.connected = False
+        finally:
+            self.initialized = True
+    
+    async def ensure_initialized(self):
+        """Run initialize() once for callers that may start before the app's startup hook"""
+        if self.initialized:
+            return
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if not self.initialized:
+                await self.initialize()
     
     async def get_tile(self, cache_key: str) -> Optional[bytes]:
         """Get tile from cache (Redis or Memory fallback)"""
@@ -32,7 +174,7 @@ class CacheService:
             if self.connected:
                 cached_data = await self.redis_client.get(cache_key)
                 if cached_data:
-                    return cached_data
+                    return _unpack_tile(cached_data)
             
             # Memory fallback
             return self.memory_cache.get(cache_key)
@@ -41,30 +183,75 @@ class CacheService:
             logger.error(f"Error getting tile from cache: {str(e)}")
             return self.memory_cache.get(cache_key)
     
+    async def get_tiles(self, cache_keys: List[str]) -> List[Optional[bytes]]:
+        """Get many tiles in one MGET round-trip, filling misses from the memory fallback"""
+        if not cache_keys:
+            return []
+        try:
+            if self.connected:
+                values = await self.redis_client.mget(cache_keys)
+            else:
+                values = [None] * len(cache_keys)
+            
+            return [_unpack_tile(value) or self.memory_cache.get(key) for key, value in zip(cache_keys, values)]
+            
+        except Exception as e:
+            logger.error(f"Error getting tiles from cache: {str(e)}")
+            return [self.memory_cache.get(key) for key in cache_keys]
+    
     async def set_tile(self, cache_key: str, tile_data: bytes, ttl: int = None):
         """Set tile in cache (Redis and/or Memory fallback)"""
         try:
             # Memory fallback
-            self.memory_cache[cache_key] = tile_data
-            if len(self.memory_cache) > 200: # Simple LRU-ish cleanup
-                self.memory_cache.pop(next(iter(self.memory_cache)))
+            self.memory_cache.set(cache_key, tile_data)
 
             if self.connected:
                 ttl = ttl or settings.cache_ttl
-                await self.redis_client.setex(cache_key, ttl, tile_data)
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.setex(cache_key, ttl, _pack_tile(tile_data))
+                    self._index_tile(pipe, cache_key, ttl)
+                    await pipe.execute()
             
         except Exception as e:
             logger.error(f"Error setting tile in cache: {str(e)}")
     
+    async def set_tiles(self, items: Dict[str, bytes], ttl: int = None):
+        """Set many tiles (and their index entries) in one pipelined round-trip"""
+        try:
+            for cache_key, tile_data in items.items():
+                self.memory_cache.set(cache_key, tile_data)
+            
+            if self.connected and items:
+                ttl = ttl or settings.cache_ttl
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    for cache_key, tile_data in items.items():
+                        pipe.setex(cache_key, ttl, _pack_tile(tile_data))
+                        self._index_tile(pipe, cache_key, ttl)
+                    await pipe.execute()
+            
+        except Exception as e:
+            logger.error(f"Error setting tiles in cache: {str(e)}")
+    
+    def _index_tile(self, pipe, cache_key: str, ttl: int):
+        """Queue the index-set writes that let invalidation find `cache_key` without scanning"""
+        index_keys = tile_index_keys(cache_key)
+        if not index_keys:
+            return
+        for index_key in index_keys:
+            pipe.sadd(index_key, cache_key)
+            # Refreshed on every write so the index lives as long as its newest tile
+            pipe.expire(index_key, ttl)
+    
     async def get_metadata(self, cache_key: str) -> Optional[Dict[str, Any]]:
         """Get metadata from cache"""
         try:
             if not self.connected:
                 return None
             
-            cached_data = await self.redis_client.get(f"meta:{cache_key}")
+            # "meta2:" keeps these apart from entries written as JSON under "meta:"
+            cached_data = await self.redis_client.get(f"meta2:{cache_key}")
             if cached_data:
-                return json.loads(cached_data)
+                return msgpack.unpackb(_ZSTD_DECOMPRESSOR.decompress(cached_data), raw=False)
             return None
             
         except Exception as e:
@@ -79,67 +266,272 @@ class CacheService:
             
             ttl = ttl or settings.cache_ttl
             await self.redis_client.setex(
-                f"meta:{cache_key}", 
+                f"meta2:{cache_key}", 
                 ttl, 
-                json.dumps(metadata)
+                _ZSTD_COMPRESSOR.compress(msgpack.packb(metadata, use_bin_type=True))
             )
             
         except Exception as e:
             logger.error(f"Error setting metadata in cache: {str(e)}")
     
+    async def get_response(self, cache_key: str) -> Optional[bytes]:
+        """Get a serialized API response from cache"""
+        try:
+            if not self.connected:
+                return None
+            
+            return await self.redis_client.get(f"resp:{cache_key}")
+            
+        except Exception as e:
+            logger.error(f"Error getting response from cache: {str(e)}")
+            return None
+    
+    async def set_response(self, cache_key: str, body: bytes, ttl: int = None, scope: Optional[str] = None):
+        """Set a serialized API response in cache, indexed under its image/annotation scope"""
+        try:
+            if not self.connected:
+                return
+            
+            ttl = ttl or settings.cache_ttl
+            key = f"resp:{cache_key}"
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.setex(key, ttl, body)
+                if scope is not None:
+                    index_key = f"resp:idx:{scope}"
+                    pipe.sadd(index_key, key)
+                    # The index outlives its longest-lived entry, then expires with it
+                    pipe.expire(index_key, ttl, nx=True)
+                    pipe.expire(index_key, ttl, gt=True)
+                await pipe.execute()
+            
+        except Exception as e:
+            logger.error(f"Error setting response in cache: {str(e)}")
+    
+    async def invalidate_responses(self, scope: str, batch_size: int = 500):
+        """
+        Invalidate every cached API response of an image/annotation scope.
+        Deletes through the scope's index set rather than scanning the keyspace; only the
+        members read are removed, so a response cached meanwhile stays indexed.
+        """
+        try:
+            if not self.connected:
+                return
+            
+            index_key = f"resp:idx:{scope}"
+            keys = list(await self.redis_client.smembers(index_key))
+            for start in range(0, len(keys), batch_size):
+                batch = keys[start:start + batch_size]
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.delete(*batch)
+                    pipe.srem(index_key, *batch)
+                    await pipe.execute()
+            if keys:
+                logger.info(f"Invalidated {len(keys)} cached responses for {scope}")
+                
+        except Exception as e:
+            logger.error(f"Error invalidating response cache: {str(e)}")
+    
+    async def get_status(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a status record stored as a Redis hash (or memory fallback)"""
+        try:
+            if self.connected:
+                fields = await self.redis_client.hgetall(key)
+                if fields:
+                    status = {k.decode(): v.decode() for k, v in fields.items()}
+                    for field in _STATUS_INT_FIELDS:
+                        if field in status:
+                            status[field] = int(status[field])
+                    return status
+            
+            return self.status_cache.get(key)
+            
+        except Exception as e:
+            logger.error(f"Error getting status from cache: {str(e)}")
+            return self.status_cache.get(key)
+    
+    async def set_status(self, key: str, status: Dict[str, Any], ttl: int = None):
+        """Replace a status record as a Redis hash in a single pipelined round-trip"""
+        try:
+            if not self.connected:
+                self.status_cache[key] = status
+                return
+            
+            ttl = ttl or settings.cache_ttl
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.delete(key)
+                pipe.hset(key, mapping=status)
+                pipe.expire(key, ttl)
+                await pipe.execute()
+            
+        except Exception as e:
+            logger.error(f"Error setting status in cache: {str(e)}")
+            self.status_cache[key] = status
+    
+    async def acquire_lock(self, key: str, ttl: int = 3600) -> Optional[str]:
+        """
+        Atomically take a lock with SET NX EX under a random token.
+        Returns the token to pass to release_lock, or None if someone else holds the lock.
+        """
+        try:
+            token = secrets.token_hex(16)
+            if self.connected:
+                return token if await self.redis_client.set(key, token, nx=True, ex=ttl) else None
+            
+            now = time.monotonic()
+            expiry, _ = self.lock_cache.get(key, (0, None))
+            if expiry > now:
+                return None
+            self.lock_cache[key] = (now + ttl, token)
+            return token
+            
+        except Exception as e:
+            logger.error(f"Error acquiring lock {key}: {str(e)}")
+            return None
+    
+    async def release_lock(self, key: str, token: str):
+        """
+        Release a lock taken with acquire_lock, only if `token` still owns it.
+        A holder whose lock expired and was re-taken can't delete the new holder's lock.
+        """
+        try:
+            if self.lock_cache.get(key, (0, None))[1] == token:
+                del self.lock_cache[key]
+            if self.connected:
+                await self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+                
+        except Exception as e:
+            logger.error(f"Error releasing lock {key}: {str(e)}")
+    
+    async def is_locked(self, key: str) -> bool:
+        """Check whether a lock is currently held"""
+        try:
+            if self.connected:
+                return bool(await self.redis_client.exists(key))
+            return self.lock_cache.get(key, (0, None))[0] > time.monotonic()
+            
+        except Exception as e:
+            logger.error(f"Error checking lock {key}: {str(e)}")
+            return False
+    
     async def invalidate_tile(self, image_id: str, z: int, x: int, y: int):
-        """Invalidate specific tile cache"""
+        """Invalidate every variation of one tile via its index set"""
         try:
+            self.memory_cache.pop_prefix(f"{image_id}:{z}:{x}:{y}:")
             if not self.connected:
                 return
             
-            # Generate pattern for all variations of this tile
-            pattern = f"{image_id}:{z}:{x}:{y}:*"
-            keys = await self.redis_client.keys(pattern)
+            tile_index = f"tiles:{image_id}:{z}:{x}:{y}"
+            keys = await self.redis_client.smembers(tile_index)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                if keys:
+                    pipe.delete(*keys)
+                    pipe.srem(f"tiles:{image_id}", *keys)
+                pipe.delete(tile_index)
+                await pipe.execute()
             
             if keys:
-                await self.redis_client.delete(*keys)
                 logger.info(f"Invalidated {len(keys)} cache entries for tile {image_id}/{z}/{x}/{y}")
                 
         except Exception as e:
             logger.error(f"Error invalidating tile cache: {str(e)}")
     
     async def invalidate_image(self, image_id: str):
-        """Invalidate all tiles for an image"""
+        """Invalidate all tiles for an image via its index set"""
         try:
+            self.memory_cache.pop_prefix(f"{image_id}:")
             if not self.connected:
                 return
             
-            pattern = f"{image_id}:*"
-            keys = await self.redis_client.keys(pattern)
+            image_index = f"tiles:{image_id}"
+            keys = await self.redis_client.smembers(image_index)
+            # Drop the per-tile index sets along with the tiles they point at
+            tile_indexes = {tile_index_keys(key.decode())[1] for key in keys}
+            await self.redis_client.delete(*keys, *tile_indexes, image_index)
             
             if keys:
-                await self.redis_client.delete(*keys)
                 logger.info(f"Invalidated {len(keys)} cache entries for image {image_id}")
                 
         except Exception as e:
             logger.error(f"Error invalidating image cache: {str(e)}")
     
-    async def get_cache_stats(self) -> Dict[str, Any]:
-        """Get cache statistics"""
+    async def get_cache_stats(self, image_id: Optional[str] = None) -> Dict[str, Any]:
+        """Get cache statistics, scoped to one image's tiles when `image_id` is given"""
         try:
             if not self.connected:
-                return {"status": "disconnected"}
+                return {"status": "disconnected", "memory_cache": self.memory_cache.stats()}
             
-            info = await self.redis_client.info()
-            return {
-                "status": "connected",
-                "used_memory": info.get("used_memory_human", "unknown"),
-                "connected_clients": info.get("connected_clients", 0),
-                "total_commands_processed": info.get("total_commands_processed", 0),
-                "keyspace_hits": info.get("keyspace_hits", 0),
-                "keyspace_misses": info.get("keyspace_misses", 0)
-            }
+            if image_id is not None:
+                return await self._get_image_cache_stats(image_id)
+            
+            return {**await self._get_server_stats(), "memory_cache": self.memory_cache.stats()}
             
         except Exception as e:
             logger.error(f"Error getting cache stats: {str(e)}")
             return {"status": "error", "error": str(e)}
     
+    async def _get_server_stats(self, max_age: float = 1.0) -> Dict[str, Any]:
+        """
+        Redis server stats from INFO, fetched at most once per `max_age` seconds so dashboards
+        polling /stats collapse into one call. Only the sections that are reported get requested.
+        """
+        fetched_at, stats = self._info_cache
+        now = time.monotonic()
+        if stats is not None and now - fetched_at < max_age:
+            return stats
+        
+        info = await self.redis_client.info("memory", "clients", "stats")
+        stats = {
+            "status": "connected",
+            "used_memory": info.get("used_memory_human", "unknown"),
+            "connected_clients": info.get("connected_clients", 0),
+            "total_commands_processed": info.get("total_commands_processed", 0),
+            "keyspace_hits": info.get("keyspace_hits", 0),
+            "keyspace_misses": info.get("keyspace_misses", 0)
+        }
+        self._info_cache = (now, stats)
+        return stats
+    
+    async def _get_image_cache_stats(self, image_id: str, batch_size: int = 500) -> Dict[str, Any]:
+        """Count and size an image's tile keys by walking its index set with SSCAN, pipelining MEMORY USAGE / TTL per batch"""
+        tile_count = 0
+        total_bytes = 0
+        ttls = []
+        
+        async def measure(keys):
+            nonlocal tile_count, total_bytes
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.memory_usage(key)
+                    pipe.ttl(key)
+                results = await pipe.execute()
+            for size, ttl in zip(results[::2], results[1::2]):
+                # Indexed keys can expire before the pipeline reaches them
+                if size is None:
+                    continue
+                tile_count += 1
+                total_bytes += size
+                if ttl is not None and ttl >= 0:
+                    ttls.append(ttl)
+        
+        batch = []
+        async for key in self.redis_client.sscan_iter(f"tiles:{image_id}", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                await measure(batch)
+                batch = []
+        if batch:
+            await measure(batch)
+        
+        return {
+            "status": "connected",
+            "tile_count": tile_count,
+            "memory_bytes": total_bytes,
+            "ttl_range": {
+                "min": min(ttls) if ttls else None,
+                "max": max(ttls) if ttls else None
+            }
+        }
+    
     async def health_check(self) -> Dict[str, Any]:
         """Check cache service health"""
         try:
@@ -158,6 +550,8 @@ class CacheService:
         try:
             if self.redis_client:
                 await self.redis_client.close()
+                # A pool passed in explicitly is not closed along with the client
+                await self.redis_pool.disconnect()
                 self.connected = False
                 logger.info("Cache service closed")
         except Exception as e:
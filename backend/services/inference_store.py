@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import insert
+
+from ..models.database import AsyncSessionLocal
+from ..models.models import TileMetadata
+from .cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+class InferenceResultStore:
+    """
+    Buffers per-tile inference results and persists them with batched multi-row INSERTs.
+    A background consumer flushes every `flush_interval` seconds or `batch_size` rows, whichever comes first.
+    """
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+
+    async def initialize(self):
+        """Start the background consumer"""
+        self.queue = asyncio.Queue()
+        self._consumer = asyncio.create_task(self._run())
+        logger.info("Inference result store initialized")
+
+    async def add(self, row: Dict[str, Any]):
+        """Queue a tile_metadata row for the next batched insert"""
+        if self._consumer is None or self._consumer.done():
+            # Consumer isn't running (e.g. outside the app lifecycle): write straight through
+            await self._flush([row])
+            return
+        await self.queue.put(row)
+
+    async def _run(self):
+        """Drain the queue in batches until a shutdown sentinel arrives"""
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self.queue.get()
+            if row is None:
+                return
+
+            rows = [row]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(rows) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+
+            await self._flush(rows)
+            if stopping:
+                return
+
+    async def _flush(self, rows: List[Dict[str, Any]]):
+        """Insert a batch of rows in one statement and commit once, then bust the images' cached responses"""
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(TileMetadata), rows)
+                await db.commit()
+            logger.info(f"Stored {len(rows)} inference results")
+            for image_id in {row["image_id"] for row in rows}:
+                await cache_service.invalidate_responses(image_id)
+        except Exception as e:
+            logger.error(f"Error storing inference results: {str(e)}")
+
+    async def close(self):
+        """Flush any queued rows and stop the consumer"""
+        try:
+            if self._consumer is not None and not self._consumer.done():
+                await self.queue.put(None)
+                await self._consumer
+            self._consumer = None
+            logger.info("Inference result store closed")
+        except Exception as e:
+            logger.error(f"Error closing inference result store: {str(e)}")
+
+# Global instance
+inference_store = InferenceResultStore()
@@ -1,11 +1,16 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageFilter, ImageFont
 import cv2
 import logging
 from typing import Dict, List, Tuple, Optional, Any
 import asyncio
+import fcntl
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
 
@@ -13,18 +18,82 @@ from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+try:
+    from numba import njit, prange
+except ImportError:  # Plain-Python fallback keeps labels working without numba
+    prange = range
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+try:
+    import kornia
+except ImportError:  # Enhancement then denoises on the CPU with OpenCV after the SR pass
+    kornia = None
+
+# Label box outline: colour and thickness in pixels
+LABEL_COLOR = (255, 0, 0)
+LABEL_WIDTH = 2
+
+@njit(cache=True, parallel=True, nogil=True)
+def draw_feature_boxes(img, boxes, scores, threshold):
+    """
+    Draw the outline of every box scoring at least `threshold` into an (H, W, 3) uint8 image in place.
+    Boxes are (N, 4) int32 [x0, y0, x1, y1] and are clipped to the image.
+    """
+    height, width = img.shape[0], img.shape[1]
+    for i in prange(boxes.shape[0]):
+        if scores[i] < threshold:
+            continue
+        x0 = max(boxes[i, 0], 0)
+        y0 = max(boxes[i, 1], 0)
+        x1 = min(boxes[i, 2], width - 1)
+        y1 = min(boxes[i, 3], height - 1)
+        if x0 > x1 or y0 > y1:
+            continue
+        for t in range(LABEL_WIDTH):
+            for x in range(x0, x1 + 1):
+                for c in range(3):
+                    img[min(y0 + t, y1), x, c] = LABEL_COLOR[c]
+                    img[max(y1 - t, y0), x, c] = LABEL_COLOR[c]
+            for y in range(y0, y1 + 1):
+                for c in range(3):
+                    img[y, min(x0 + t, x1), c] = LABEL_COLOR[c]
+                    img[y, max(x1 - t, x0), c] = LABEL_COLOR[c]
+
+def _unsharp_mask(img_array: np.ndarray, sigma: float = 2.0, amount: float = 1.5, threshold: int = 3) -> np.ndarray:
+    """OpenCV equivalent of PIL's UnsharpMask(radius=2, percent=150, threshold=3) on a uint8 array"""
+    blurred = cv2.GaussianBlur(img_array, (0, 0), sigma)
+    sharpened = cv2.addWeighted(img_array, 1 + amount, blurred, -amount, 0)
+    # Like PIL, leave pixels that differ from the blur by less than `threshold` untouched
+    np.copyto(sharpened, img_array, where=cv2.absdiff(img_array, blurred) < threshold)
+    return sharpened
+
 class MLService:
     def __init__(self):
         self.device = torch.device("cuda" if torch.cuda.is_available() and settings.gpu_enabled else "cpu")
         self.models = {}
         self.models_loaded = False
         self.batch_size = settings.batch_size
+        self.sr_queue: Optional[asyncio.Queue] = None
+        self._sr_batcher: Optional[asyncio.Task] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._hough_gpu = None
+        # Captured single-tile SR passes by (height, width): (graph, static input, static output)
+        self._sr_graphs: Dict[Tuple[int, int], Tuple[Any, torch.Tensor, torch.Tensor]] = {}
+        self._sr_graph_lock = threading.Lock()
+        self._hough_gpu_lock = threading.Lock()
         
     async def initialize_models(self):
         """Initialize all ML models"""
         try:
             logger.info(f"Initializing ML models on device: {self.device}")
             
+            if self._pool is None:
+                # One bounded pool behind every asyncio.to_thread call. OpenCV, PIL and torch release the
+                # GIL in their C code, so threads already run them in parallel without pickling to processes.
+                self._pool = ThreadPoolExecutor(max_workers=settings.ml_threads, thread_name_prefix="ml")
+                asyncio.get_running_loop().set_default_executor(self._pool)
+            
             # Initialize super-resolution model
             await self._load_sr_model()
             
@@ -38,6 +107,12 @@ class MLService:
             await self._load_classification_model()
             
             self.models_loaded = True
+            
+            # Concurrent tile requests share Real-ESRGAN forward passes
+            if self.models.get('sr') and self._sr_batcher is None:
+                self.sr_queue = asyncio.Queue()
+                self._sr_batcher = asyncio.create_task(self._run_sr_batcher())
+            
             logger.info("All ML models initialized successfully")
             
         except Exception as e:
@@ -50,6 +125,12 @@ class MLService:
             from realesrgan import RealESRGANer
             from basicsr.archs.rrdbnet_arch import RRDBNet
             
+            # Half precision halves weight/activation bandwidth, but CPU conv kernels have no fp16 path.
+            # int8 is the CPU counterpart; on CUDA, tensor cores make fp16 the faster choice.
+            half = settings.ml_precision in ("fp16", "int8") and self.device.type == 'cuda'
+            if settings.ml_precision == "fp16" and not half:
+                logger.info("fp16 requested but running on CPU; super-resolution will use fp32")
+            
             # Load Real-ESRGAN model
             model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
             self.models['sr'] = RealESRGANer(
@@ -59,14 +140,145 @@ class MLService:
                 tile=0,
                 tile_pad=10,
                 pre_pad=0,
-                half=True if self.device.type == 'cuda' else False
+                half=half,
+                # Otherwise it picks CUDA whenever present, ignoring gpu_enabled and the CPU-only int8 path
+                device=self.device
             )
-            logger.info("Super-resolution model loaded")
+            if self.device.type == 'cuda':
+                # Tiles are all the same size, so cuDNN's autotuned conv algorithms get reused every pass
+                torch.backends.cudnn.benchmark = True
+            int8 = settings.ml_precision == "int8" and self.device.type != 'cuda'
+            self.models['sr_ort'] = self._quantize_sr_model(self.models['sr']) if int8 else None
+            # The quantized session replaces the TorchScript / CUDA graph forward passes
+            self.models['sr_jit'] = None if self.models['sr_ort'] else self._trace_sr_model(self.models['sr'])
+            self._capture_sr_graphs(self.models['sr'])
+            precision = 'int8' if self.models['sr_ort'] else 'fp16' if half else 'fp32'
+            logger.info(f"Super-resolution model loaded ({precision})")
             
         except Exception as e:
             logger.warning(f"Could not load Real-ESRGAN model: {str(e)}")
             # Fallback to simple upscaling
             self.models['sr'] = None
+            self.models['sr_jit'] = None
+            self.models['sr_ort'] = None
+    
+    def _capture_sr_graphs(self, upsampler):
+        """
+        Capture a CUDA graph of the single-tile SR forward pass for each common tile size.
+        Replaying a graph launches all of RRDBNet's kernels at once instead of one Python dispatch each.
+        """
+        if self.device.type != 'cuda':
+            return
+        
+        model = self.models.get('sr_jit') or upsampler.model
+        dtype = torch.float16 if upsampler.half else torch.float32
+        for size in sorted({256, settings.tile_size}):
+            try:
+                static_in = torch.zeros(1, 3, size, size, device=upsampler.device, dtype=dtype)
+                with torch.no_grad():
+                    # Capture needs warmed-up kernels and allocator state, built on a side stream
+                    stream = torch.cuda.Stream()
+                    stream.wait_stream(torch.cuda.current_stream())
+                    with torch.cuda.stream(stream):
+                        for _ in range(3):
+                            model(static_in)
+                    torch.cuda.current_stream().wait_stream(stream)
+                    
+                    graph = torch.cuda.CUDAGraph()
+                    with torch.cuda.graph(graph):
+                        static_out = model(static_in)
+                self._sr_graphs[(size, size)] = (graph, static_in, static_out)
+            except Exception as e:
+                logger.warning(f"Could not capture SR CUDA graph for {size}px tiles: {str(e)}")
+        
+        if self._sr_graphs:
+            logger.info(f"Captured SR CUDA graphs for tile sizes: {sorted(h for h, _ in self._sr_graphs)}")
+    
+    @staticmethod
+    def _cpu_has_vnni() -> bool:
+        """Whether the CPU has VNNI int8 dot-product instructions (AVX512-VNNI or AVX-VNNI)"""
+        try:
+            with open("/proc/cpuinfo") as f:
+                flags = next((line for line in f if line.startswith("flags")), "").split()
+            return "avx512_vnni" in flags or "avx_vnni" in flags
+        except OSError:
+            return False
+    
+    def _quantize_sr_model(self, upsampler):
+        """
+        Export RRDBNet to ONNX, quantize its weights to int8 with ONNX Runtime, and open a CPU session.
+        The quantized model is written next to the weights and reused on later starts.
+        Returns None (fp32 PyTorch) without VNNI, where int8 convolutions are no faster, or on any failure.
+        """
+        if not self._cpu_has_vnni():
+            logger.info("int8 requested but the CPU has no VNNI; super-resolution will use fp32")
+            return None
+        try:
+            import onnxruntime as ort
+            
+            models_dir = Path(settings.models_dir)
+            int8_path = models_dir / "RealESRGAN_x4plus.int8.onnx"
+            if not int8_path.exists():
+                # Every worker loads the model at startup; one exports while the others wait for it
+                with open(models_dir / "RealESRGAN_x4plus.onnx.lock", "w") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    if not int8_path.exists():
+                        self._export_int8_model(upsampler, int8_path)
+            
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = settings.ml_threads
+            session = ort.InferenceSession(str(int8_path), options, providers=["CPUExecutionProvider"])
+            logger.info(f"Super-resolution model quantized to int8 ({int8_path})")
+            return session
+        except Exception as e:
+            logger.warning(f"Could not quantize Real-ESRGAN model, running it in fp32: {str(e)}")
+            return None
+    
+    def _export_int8_model(self, upsampler, int8_path: Path):
+        """Export RRDBNet to ONNX and quantize it, writing through per-process temp files renamed into place"""
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        
+        pid = os.getpid()
+        fp32_path = int8_path.with_name(f"RealESRGAN_x4plus.{pid}.onnx")
+        tmp_path = int8_path.with_name(f"{int8_path.name}.{pid}.tmp")
+        example = torch.rand(1, 3, 64, 64, device=upsampler.device)
+        axes = {0: "batch", 2: "height", 3: "width"}
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    upsampler.model.eval(), example, str(fp32_path),
+                    input_names=["input"], output_names=["output"],
+                    dynamic_axes={"input": axes, "output": axes},
+                    opset_version=17
+                )
+            quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QUInt8)
+            os.replace(tmp_path, int8_path)
+        finally:
+            fp32_path.unlink(missing_ok=True)
+            tmp_path.unlink(missing_ok=True)
+    
+    def _trace_sr_model(self, upsampler) -> Optional[torch.jit.ScriptModule]:
+        """
+        TorchScript-trace and freeze the RRDBNet once so forward passes skip per-layer Python dispatch
+        and get fused element-wise ops. Returns None (eager mode) if tracing fails.
+        """
+        try:
+            dtype = torch.float16 if upsampler.half else torch.float32
+            on_cpu = upsampler.device.type == "cpu"
+            # A tile-sized RRDBNet pass takes seconds on CPU; the traced graph is shape-agnostic either way
+            size = 64 if on_cpu else settings.tile_size
+            example = torch.rand(1, 3, size, size, device=upsampler.device, dtype=dtype)
+            with torch.no_grad():
+                traced = torch.jit.trace(upsampler.model.eval(), example)
+                traced = torch.jit.optimize_for_inference(traced)
+                if not on_cpu:
+                    # The first calls of a frozen module run its profiling passes; get them out of the way now
+                    traced(example)
+            logger.info("Super-resolution model traced with TorchScript")
+            return traced
+        except Exception as e:
+            logger.warning(f"Could not trace Real-ESRGAN model, running it in eager mode: {str(e)}")
+            return None
     
     async def _load_denoising_model(self):
         """Load denoising model"""
@@ -87,7 +299,14 @@ class MLService:
             # For now, use a simple threshold-based approach
             # In production, load U-Net or Mask R-CNN
             self.models['segmentation'] = 'threshold'
-            logger.info("Segmentation model loaded")
+            
+            # CUDA builds of OpenCV run the crater Hough transform on the GPU
+            if self.device.type == 'cuda' and hasattr(cv2, 'cuda') and cv2.cuda.getCudaEnabledDeviceCount() > 0:
+                # dp, minDist, cannyThreshold, votesThreshold, minRadius, maxRadius: same as the CPU call
+                self._hough_gpu = cv2.cuda.createHoughCirclesDetector(1, 20, 50, 30, 5, 50)
+                logger.info("Segmentation model loaded (CUDA Hough transform)")
+            else:
+                logger.info("Segmentation model loaded")
             
         except Exception as e:
             logger.warning(f"Could not load segmentation model: {str(e)}")
@@ -108,45 +327,207 @@ class MLService:
     async def super_resolve(self, image: Image.Image) -> Image.Image:
         """Apply super-resolution to image"""
         try:
-            if not self.models_loaded or not self.models.get('sr'):
-                # Improved fallback: High-quality Lanczos + Smart Sharpening
-                upscaled = image.resize((image.width * 2, image.height * 2), Image.LANCZOS)
-                
-                # Apply subtle sharpening to the upscaled image to avoid blur
-                from PIL import ImageFilter
-                upscaled = upscaled.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
-                return upscaled
-            
-            # Convert PIL to numpy
-            img_array = np.array(image)
-            
-            # Apply Real-ESRGAN
-            sr_array, _ = self.models['sr'].enhance(img_array, outscale=2)
-            
-            # Convert back to PIL
-            return Image.fromarray(sr_array)
+            # Off the event loop: upscaling is CPU/GPU-bound
+            return await asyncio.to_thread(self._super_resolve_sync, image)
             
         except Exception as e:
             logger.error(f"Error in super-resolution: {str(e)}")
             return image
     
+    def _super_resolve_sync(self, image: Image.Image) -> Image.Image:
+        """Blocking super-resolution body, run in a worker thread"""
+        if not self.models_loaded or not self.models.get('sr'):
+            # Improved fallback: High-quality Lanczos + Smart Sharpening
+            if image.mode in ('RGB', 'L'):
+                # Straight on the pixel buffer: one view in, one array out, no intermediate PIL images
+                img_array = np.asarray(image)
+                upscaled = cv2.resize(img_array, (image.width * 2, image.height * 2), interpolation=cv2.INTER_LANCZOS4)
+                return Image.fromarray(_unsharp_mask(upscaled))
+            
+            upscaled = image.resize((image.width * 2, image.height * 2), Image.LANCZOS)
+            
+            # Apply subtle sharpening to the upscaled image to avoid blur
+            upscaled = upscaled.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
+            return upscaled
+        
+        # View the PIL buffer as numpy and apply Real-ESRGAN
+        return Image.fromarray(self._super_resolve_array(np.asarray(image)))
+    
+    def _super_resolve_array(self, img_array: np.ndarray) -> np.ndarray:
+        """Real-ESRGAN on one ndarray: RGB uint8 tiles take the on-device tensor path, anything else RealESRGANer.enhance"""
+        if img_array.dtype == np.uint8 and img_array.ndim == 3 and img_array.shape[2] == 3:
+            return self._super_resolve_batch_sync([img_array])[0]
+        return self._enhance_with_upsampler(img_array)
+    
+    def _enhance_with_upsampler(self, img_array: np.ndarray) -> np.ndarray:
+        """2x RealESRGANer.enhance on an RGB(A) or greyscale ndarray; enhance takes and returns OpenCV's BGR(A) order"""
+        if img_array.ndim == 3 and img_array.shape[2] == 4:
+            sr_array, _ = self.models['sr'].enhance(cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGRA), outscale=2)
+            return cv2.cvtColor(sr_array, cv2.COLOR_BGRA2RGBA)
+        if img_array.ndim == 3 and img_array.shape[2] == 3:
+            sr_array, _ = self.models['sr'].enhance(cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR), outscale=2)
+            return cv2.cvtColor(sr_array, cv2.COLOR_BGR2RGB)
+        sr_array, _ = self.models['sr'].enhance(img_array, outscale=2)
+        return sr_array
+    
     async def denoise(self, image: Image.Image) -> Image.Image:
         """Apply denoising to image"""
         try:
-            # Convert PIL to numpy
-            img_array = np.array(image)
+            # Off the event loop: OpenCV releases the GIL while filtering
+            return await asyncio.to_thread(self._denoise_sync, image)
             
-            # Use Bilateral Filter for better edge preservation than fastNlMeans
-            # d=9 (diameter), sigmaColor=75, sigmaSpace=75
-            denoised = cv2.bilateralFilter(img_array, 9, 75, 75)
+        except Exception as e:
+            logger.error(f"Error in denoising: {str(e)}")
+            return image
+    
+    def _denoise_sync(self, image: Image.Image) -> Image.Image:
+        """Blocking denoising body, run in a worker thread"""
+        # Read-only view of the PIL buffer; the filter writes into a new array anyway
+        img_array = np.asarray(image)
+        
+        # Optional: Apply slight adaptive thresholding or more advanced denoising if needed
+        # fromarray wraps the contiguous result via frombuffer rather than copying it
+        return Image.fromarray(self._denoise_array(img_array))
+    
+    def _denoise_array(self, img_array: np.ndarray) -> np.ndarray:
+        """Denoise an RGB ndarray"""
+        # Use Bilateral Filter for better edge preservation than fastNlMeans
+        # d=9 (diameter), sigmaColor=75, sigmaSpace=75
+        return cv2.bilateralFilter(img_array, 9, 75, 75)
+    
+    async def enhance(self, image: Image.Image) -> Image.Image:
+        """Apply super-resolution followed by denoising in a single pass"""
+        try:
+            if self._sr_batcher is not None:
+                # np.asarray decodes a lazily opened tile and copies its pixels: keep it off the event loop
+                img_array = await asyncio.to_thread(np.asarray, image)
+                if img_array.dtype == np.uint8 and img_array.ndim == 3 and img_array.shape[2] == 3:
+                    return Image.fromarray(await self._enhance_batched(img_array))
             
-            # Optional: Apply slight adaptive thresholding or more advanced denoising if needed
-            return Image.fromarray(denoised)
+            return await asyncio.to_thread(self._enhance_sync, image)
             
         except Exception as e:
-            logger.error(f"Error in denoising: {str(e)}")
+            logger.error(f"Error in enhancement: {str(e)}")
             return image
     
+    def _enhance_sync(self, image: Image.Image) -> Image.Image:
+        """Blocking SR + denoise body, run in one worker thread"""
+        if self.models_loaded and self.models.get('sr'):
+            # Hand the Real-ESRGAN output straight to the denoiser instead of round-tripping through PIL
+            img_array = np.asarray(image)
+            if img_array.dtype == np.uint8 and img_array.ndim == 3 and img_array.shape[2] == 3:
+                return Image.fromarray(self._enhance_batch_sync([img_array])[0])
+            return Image.fromarray(self._denoise_array(self._enhance_with_upsampler(img_array)))
+        
+        return self._denoise_sync(self._super_resolve_sync(image))
+    
+    async def _enhance_batched(self, img_array: np.ndarray) -> np.ndarray:
+        """Queue an RGB uint8 tile for the next batched SR + denoise pass"""
+        future = asyncio.get_running_loop().create_future()
+        await self.sr_queue.put((img_array, future))
+        return await future
+    
+    async def _run_sr_batcher(self):
+        """Collect queued tiles for up to `ml_batch_window_ms` or `batch_size` items, then run them together"""
+        loop = asyncio.get_running_loop()
+        window = settings.ml_batch_window_ms / 1000
+        while True:
+            items = [await self.sr_queue.get()]
+            deadline = loop.time() + window
+            while len(items) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.sr_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Only same-sized tiles can be stacked into one tensor
+            groups: Dict[Tuple[int, ...], List[Tuple[np.ndarray, asyncio.Future]]] = {}
+            for img_array, future in items:
+                groups.setdefault(img_array.shape, []).append((img_array, future))
+            
+            for group in groups.values():
+                try:
+                    outputs = await asyncio.to_thread(self._enhance_batch_sync, [a for a, _ in group])
+                    for (_, future), output in zip(group, outputs):
+                        if not future.done():
+                            future.set_result(output)
+                except Exception as e:
+                    logger.error(f"Error in batched enhancement: {str(e)}")
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+    
+    def _super_resolve_batch_sync(self, arrays: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        One Real-ESRGAN forward pass over a stack of same-sized tiles, run in a worker thread.
+        Scales to 0-1 and Lanczos-resizes the 4x output down to 2x, as RealESRGANer.enhance does.
+        Pixels cross the host/device bus as uint8 in both directions; scaling, layout and precision
+        changes all happen on the device.
+        """
+        with torch.inference_mode():
+            output = self._to_host(self._sr_forward(arrays))
+        
+        results = []
+        for img_array, sr in zip(arrays, output):
+            height, width = img_array.shape[:2]
+            results.append(cv2.resize(sr, (width * 2, height * 2), interpolation=cv2.INTER_LANCZOS4))
+        return results
+    
+    def _enhance_batch_sync(self, arrays: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        SR followed by denoising for a stack of same-sized RGB uint8 tiles, run in a worker thread.
+        On CUDA with kornia both steps stay on the device and only the finished tiles are copied back;
+        on CPU there is nothing to keep resident, and OpenCV's bilateral filter is far faster.
+        """
+        upsampler = self.models['sr']
+        if kornia is None or upsampler.device.type != 'cuda':
+            return [self._denoise_array(sr) for sr in self._super_resolve_batch_sync(arrays)]
+        
+        height, width = arrays[0].shape[:2]
+        with torch.inference_mode():
+            # Kept in the model's precision: fp16 halves the filter's working memory
+            sr = self._sr_forward(arrays)
+            # Lanczos has no device kernel; antialiased bicubic is the closest downscale to 2x
+            sr = F.interpolate(sr, size=(height * 2, width * 2), mode='bicubic', antialias=True).clamp_(0, 1)
+            # Same filter as _denoise_array: 9px kernel, sigmaColor 75 (on a 0-255 scale), sigmaSpace 75.
+            # One tile at a time: the filter unfolds an 81-wide window per pixel, too large for a whole batch
+            return [
+                self._to_host(kornia.filters.bilateral_blur(tile[None], (9, 9), 75 / 255.0, (75.0, 75.0)))[0]
+                for tile in sr
+            ]
+    
+    def _sr_forward(self, arrays: List[np.ndarray]) -> torch.Tensor:
+        """Real-ESRGAN forward pass over same-sized RGB uint8 tiles; returns 4x NCHW RGB in [0, 1] on the device"""
+        upsampler = self.models['sr']
+        dtype = torch.float16 if upsampler.half else torch.float32
+        tensor = torch.from_numpy(np.stack(arrays)).to(upsampler.device, non_blocking=True)
+        # NHWC RGB uint8 -> NCHW RGB in [0, 1], the layout the RRDBNet weights were trained on
+        tensor = tensor.permute(0, 3, 1, 2).to(dtype).div_(255.0)
+        session = self.models.get('sr_ort')
+        captured = self._sr_graphs.get(tuple(tensor.shape[2:])) if tensor.shape[0] == 1 else None
+        if session is not None:
+            # CPU only, so the ONNX Runtime input and output share memory with the tensors
+            output = torch.from_numpy(session.run(None, {"input": tensor.contiguous().numpy()})[0])
+        elif captured is not None:
+            graph, static_in, static_out = captured
+            # The static buffers are shared, so copy-in, replay and copy-out happen under one lock
+            with self._sr_graph_lock:
+                static_in.copy_(tensor)
+                graph.replay()
+                output = static_out.clone()
+        else:
+            model = self.models.get('sr_jit') or upsampler.model
+            output = model(tensor)
+        return output.clamp_(0, 1)
+    
+    @staticmethod
+    def _to_host(tensor: torch.Tensor) -> np.ndarray:
+        """Quantise an NCHW [0, 1] tensor to uint8 on the device, then copy it back as NHWC"""
+        return tensor.mul(255.0).round_().to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+    
     async def add_labels(
         self, 
         image: Image.Image, 
@@ -157,23 +538,52 @@ class MLService:
             if not self.models_loaded:
                 return image
             
-            # Create a copy for labeling
-            labeled_image = image.copy()
-            draw = ImageDraw.Draw(labeled_image)
-            
-            # Simple feature detection (replace with actual ML model)
-            features = await self._detect_features(image, confidence_threshold)
-            
-            # Draw labels
-            for feature in features:
-                self._draw_feature_label(draw, feature)
-            
-            return labeled_image
+            # Detection and drawing share one worker-thread hop, keeping the event loop free
+            return await asyncio.to_thread(self._add_labels_sync, image, confidence_threshold)
             
         except Exception as e:
             logger.error(f"Error adding labels: {str(e)}")
             return image
     
+    def _add_labels_sync(self, image: Image.Image, confidence_threshold: float) -> Image.Image:
+        """Blocking detect + draw body, run in a worker thread"""
+        # Simple feature detection (replace with actual ML model)
+        features = self._detect_feature_arrays(image, confidence_threshold)
+        return self._draw_labels_sync(image, features, confidence_threshold)
+    
+    def _add_labels_batch_sync(self, images: List[Image.Image], confidence_threshold: float) -> List[Image.Image]:
+        """Label a batch of images in one worker-thread hop: detect on every tile, then draw"""
+        features = [self._detect_feature_arrays(image, confidence_threshold) for image in images]
+        return [
+            self._draw_labels_sync(image, image_features, confidence_threshold)
+            for image, image_features in zip(images, features)
+        ]
+    
+    def _draw_labels_sync(
+        self,
+        image: Image.Image,
+        features: Dict[str, Any],
+        confidence_threshold: float
+    ) -> Image.Image:
+        """Draw detected features (as returned by _detect_feature_arrays) onto an image"""
+        if not len(features['x']):
+            return image
+        
+        # Boxes go straight into the pixel array via the numba kernel, labels via cv2.putText.
+        # PIL only exposes its buffer read-only, so this one writable copy is the only full-image
+        # allocation; convert() would add another for tiles that are already RGB.
+        img_array = np.array(image if image.mode == 'RGB' else image.convert('RGB'))
+        x, y, r = features['x'], features['y'], features['r']
+        boxes = np.stack([x - r, y - r, x + r, y + r], axis=1).astype(np.int32)
+        draw_feature_boxes(img_array, boxes, features['conf'].astype(np.float32), np.float32(confidence_threshold))
+        
+        for x0, y0, confidence in zip(boxes[:, 0].tolist(), boxes[:, 1].tolist(), features['conf'].tolist()):
+            label = f"{features['type']}: {confidence:.2f}"
+            cv2.putText(img_array, label, (x0, y0 - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5, LABEL_COLOR, 1)
+        
+        # frombuffer-backed: the labelled image shares img_array's memory instead of copying it
+        return Image.fromarray(img_array)
+    
     async def _detect_features(
         self, 
         image: Image.Image, 
@@ -181,82 +591,139 @@ class MLService:
     ) -> List[Dict[str, Any]]:
         """Detect features in image"""
         try:
-            # Convert to numpy for processing
-            img_array = np.array(image)
-            
-            # Simple feature detection (replace with actual ML model)
-            features = []
-            
-            # Detect craters using circular Hough transform
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-            circles = cv2.HoughCircles(
-                gray, cv2.HOUGH_GRADIENT, 1, 20,
-                param1=50, param2=30, minRadius=5, maxRadius=50
-            )
-            
-            if circles is not None:
-                circles = np.round(circles[0, :]).astype("int")
-                for (x, y, r) in circles:
-                    features.append({
-                        'type': 'crater',
-                        'confidence': 0.8,
-                        'bbox': [x-r, y-r, x+r, y+r],
-                        'center': [x, y],
-                        'radius': r
-                    })
-            
-            # Filter by confidence threshold
-            return [f for f in features if f['confidence'] >= confidence_threshold]
+            # Off the event loop: the Hough transform is CPU-bound
+            return await asyncio.to_thread(self._detect_features_sync, image, confidence_threshold)
             
         except Exception as e:
             logger.error(f"Error detecting features: {str(e)}")
             return []
     
-    def _draw_feature_label(self, draw: ImageDraw.Draw, feature: Dict[str, Any]):
-        """Draw feature label on image"""
+    def _detect_features_sync(
+        self, 
+        image: Image.Image, 
+        confidence_threshold: float
+    ) -> List[Dict[str, Any]]:
+        """Blocking feature detection body, run in a worker thread; one dict per feature for API responses"""
+        features = self._detect_feature_arrays(image, confidence_threshold)
+        
+        # Plain ints/floats so features serialize to JSON (API responses, tile_metadata rows)
+        return [
+            {
+                'type': features['type'],
+                'confidence': confidence,
+                'bbox': [x - r, y - r, x + r, y + r],
+                'center': [x, y],
+                'radius': r
+            }
+            for x, y, r, confidence in zip(
+                features['x'].tolist(), features['y'].tolist(), features['r'].tolist(), features['conf'].tolist()
+            )
+        ]
+    
+    def _detect_feature_arrays(self, image: Image.Image, confidence_threshold: float) -> Dict[str, Any]:
+        """
+        Detect craters as a struct of arrays: int32 `x`, `y`, `r` and float64 `conf`, one entry per feature,
+        already filtered by `confidence_threshold` with a single boolean mask.
+        """
+        # Read-only view is enough: cvtColor writes its own output
+        img_array = np.asarray(image)
+        
+        # Detect craters using circular Hough transform
+        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        circles = self._hough_circles(gray)
+        if circles is not None and circles.size:
+            circles = np.round(circles[0]).astype(np.int32)
+        else:
+            circles = np.empty((0, 3), dtype=np.int32)
+        
+        # The Hough transform has no per-circle score; every crater gets the same fixed confidence
+        conf = np.full(len(circles), 0.8)
+        mask = conf >= confidence_threshold
+        return {
+            'type': 'crater',
+            'x': circles[mask, 0],
+            'y': circles[mask, 1],
+            'r': circles[mask, 2],
+            'conf': conf[mask]
+        }
+    
+    def _hough_circles(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """Circular Hough transform as a (1, N, 3) array of x, y, r; on the GPU when OpenCV has CUDA"""
+        if self._hough_gpu is not None:
+            gpu_gray = cv2.cuda_GpuMat()
+            gpu_gray.upload(gray)
+            # One detector is shared across worker threads and holds GPU scratch buffers
+            with self._hough_gpu_lock:
+                circles = self._hough_gpu.detect(gpu_gray)
+            return circles.download() if not circles.empty() else None
+        
+        return cv2.HoughCircles(
+            gray, cv2.HOUGH_GRADIENT, 1, 20,
+            param1=50, param2=30, minRadius=5, maxRadius=50
+        )
+    
+    def warm_up(self):
+        """Compile the numba label kernel on a dummy input so the first labelled tile doesn't pay for it"""
         try:
-            bbox = feature['bbox']
-            confidence = feature['confidence']
-            feature_type = feature['type']
-            
-            # Draw bounding box
-            draw.rectangle(bbox, outline='red', width=2)
-            
-            # Draw label
-            label = f"{feature_type}: {confidence:.2f}"
-            draw.text((bbox[0], bbox[1] - 20), label, fill='red')
-            
+            draw_feature_boxes(
+                np.zeros((1, 1, 3), dtype=np.uint8),
+                np.zeros((1, 4), dtype=np.int32),
+                np.ones(1, dtype=np.float32),
+                np.float32(0.5)
+            )
+            logger.info("Label kernel compiled")
         except Exception as e:
-            logger.error(f"Error drawing feature label: {str(e)}")
+            logger.warning(f"Could not warm up label kernel: {str(e)}")
     
     async def batch_process(
         self, 
         images: List[Image.Image], 
         operations: List[str]
     ) -> List[Image.Image]:
-        """Process multiple images in batch"""
+        """
+        Process multiple images in batch.
+        Same-sized RGB tiles are stacked into one Real-ESRGAN forward pass per `batch_size` images.
+        """
         try:
-            results = []
+            results = list(images)
+            fused = 'sr' in operations and 'denoise' in operations
             
-            for i in range(0, len(images), self.batch_size):
-                batch = images[i:i + self.batch_size]
-                batch_results = []
+            batched = set()
+            if 'sr' in operations and self.models_loaded and self.models.get('sr'):
+                batch_fn = self._enhance_batch_sync if fused else self._super_resolve_batch_sync
                 
-                for img in batch:
-                    processed_img = img
-                    
-                    if 'sr' in operations:
+                # Bucket by shape: only same-sized tiles can be stacked into one tensor
+                arrays = {}
+                buckets: Dict[Tuple[int, ...], List[int]] = {}
+                for i, img in enumerate(results):
+                    img_array = np.asarray(img)
+                    if img_array.dtype == np.uint8 and img_array.ndim == 3 and img_array.shape[2] == 3:
+                        arrays[i] = img_array
+                        buckets.setdefault(img_array.shape, []).append(i)
+                
+                for indices in buckets.values():
+                    for start in range(0, len(indices), self.batch_size):
+                        chunk = indices[start:start + self.batch_size]
+                        outputs = await asyncio.to_thread(batch_fn, [arrays[i] for i in chunk])
+                        for i, output in zip(chunk, outputs):
+                            results[i] = Image.fromarray(output)
+                batched = set(arrays)
+            
+            for i, processed_img in enumerate(results):
+                if i not in batched:
+                    if fused:
+                        processed_img = await self.enhance(processed_img)
+                    elif 'sr' in operations:
                         processed_img = await self.super_resolve(processed_img)
-                    
-                    if 'denoise' in operations:
-                        processed_img = await self.denoise(processed_img)
-                    
-                    if 'labels' in operations:
-                        processed_img = await self.add_labels(processed_img)
-                    
-                    batch_results.append(processed_img)
                 
-                results.extend(batch_results)
+                if 'denoise' in operations and 'sr' not in operations:
+                    processed_img = await self.denoise(processed_img)
+                
+                results[i] = processed_img
+            
+            if 'labels' in operations and self.models_loaded:
+                # Detection for the whole batch runs back to back in one thread, keeping the GPU detector busy
+                results = await asyncio.to_thread(self._add_labels_batch_sync, results, 0.5)
             
             return results
             
@@ -276,6 +743,12 @@ class MLService:
     async def cleanup(self):
         """Cleanup ML models"""
         try:
+            if self._sr_batcher is not None:
+                self._sr_batcher.cancel()
+                self._sr_batcher = None
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
             if hasattr(self, 'models'):
                 for model in self.models.values():
                     if hasattr(model, 'cleanup'):
@@ -1,41 +1,571 @@
 import os
+import asyncio
 import logging
-from PIL import Image
+import math
+import multiprocessing
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image, ImageFile
 import io
+import json
+import numpy as np
 import httpx
 import hashlib
-from typing import Optional, List, Dict, Any
+import aiofiles
+import xxhash
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
 from ..config import settings
 from .ml_service import ml_service
 from .cache_service import cache_service
+from .cache_backends import tile_cache, tile_cache_key, dynamic_tile_cache_key
 
 logger = logging.getLogger(__name__)
 
+# SIMD libjpeg-turbo encoder when the shared library is present; Pillow's encoder otherwise
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY, TJFLAG_PROGRESSIVE
+    _turbojpeg = TurboJPEG()
+except Exception as e:
+    logger.info(f"TurboJPEG unavailable, encoding tiles with Pillow: {str(e)}")
+    _turbojpeg = None
+
+# libvips crops dynamic tiles straight from the encoded source, decoding JPEGs at reduced size
+try:
+    import pyvips
+except Exception as e:
+    logger.info(f"pyvips unavailable, cropping dynamic tiles with Pillow: {str(e)}")
+    pyvips = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # Downsampling then stays on Pillow's Lanczos
+    njit = None
+
+# Size of the byte chunks written to clients for chunked tile responses
+TILE_STREAM_CHUNK_SIZE = 16 * 1024
+
+# Rendered tiles buffered by precomputation before one pipelined cache write
+TILE_WRITE_BATCH_SIZE = 64
+
+# Longest gap, in seconds, between precomputation progress writes
+PRECOMPUTE_STATUS_INTERVAL = 1.0
+
+# Tiles found neither in the cache nor on disk are answered as missing, without looking again, for this long
+MISSING_TILE_TTL = 300
+MISSING_TILE_LIMIT = 65536
+
+# Entries kept in the per-worker source image metadata and URL resolution LRUs
+SOURCE_META_CACHE_LIMIT = 4096
+RESOLVED_URL_LIMIT = 4096
+
+# Source tile file names inside a zoom level directory: "{x}_{y}.jpg" / ".png"
+TILE_FILE_PATTERN = re.compile(r"^(\d+)_(\d+)\.(?:jpg|png)$")
+
+# NASA image id in images-assets URLs, e.g. ".../image/PIA12345/PIA12345~thumb.jpg"
+NASA_ID_PATTERN = re.compile(r"/image/([^/]+)/")
+
+# Thumbnail -> original resolutions are stable, so they are shared through Redis for a week
+NASA_RESOLUTION_TTL = 7 * 24 * 3600
+
+# Rows of decoded pixels copied per step when writing a source image to the disk cache
+SOURCE_DISK_WRITE_ROWS = 256
+
+# Disk cache temp files older than this belong to writers that died mid-write
+SOURCE_DISK_STALE_TMP_AGE = 3600
+
+# Fraction of the disk cache limit that eviction brings the directory down to
+SOURCE_DISK_EVICT_TARGET = 0.9
+
+# Read size for streamed source image downloads
+SOURCE_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of the source formats libvips crops without a full decode
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# Downscale from which dynamic tiles are cropped from encoded JPEGs, decoded at 1/8 size by libvips
+JPEG_SHRINK_ON_LOAD_SCALE = 8
+
+# Root public directory where DZI files are stored
+_BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "public"))
+
+# Common DZI tile patterns, probed in order
+_TILE_PATH_TEMPLATES = (
+    os.path.join(_BASE_DIR, "{image_id}_files", "{z}", "{x}_{y}.jpg"),
+    os.path.join(_BASE_DIR, "{image_id}_files", "{z}", "{x}_{y}.png"),
+    os.path.join(_BASE_DIR, "tiles", "{image_id}", "{z}", "{x}_{y}.jpg"),
+)
+
+# Index of the template that last located a tile of each image: an image's tiles share one layout
+_tile_layouts: Dict[str, int] = {}
+
+# Located source tiles; only hits are memoized, absent tiles are left to the TTL'd missing-tile map
+_tile_paths: OrderedDict = OrderedDict()
+TILE_PATH_CACHE_LIMIT = 131072
+
+def _locate_source_tile(image_id: str, z: int, x: int, y: int) -> Optional[str]:
+    """
+    Locate a source tile on disk.
+    New tiles of an image whose layout is known cost one stat instead of up to three.
+    """
+    layout = _tile_layouts.get(image_id)
+    if layout is not None:
+        path = _TILE_PATH_TEMPLATES[layout].format(image_id=image_id, z=z, x=x, y=y)
+        if os.path.exists(path):
+            return path
+    
+    for index, template in enumerate(_TILE_PATH_TEMPLATES):
+        if index == layout:
+            continue
+        path = template.format(image_id=image_id, z=z, x=x, y=y)
+        if os.path.exists(path):
+            _tile_layouts[image_id] = index
+            return path
+    return None
+
+def _source_tile_path(image_id: str, z: int, x: int, y: int) -> Optional[str]:
+    """
+    Locate a source tile on disk, memoizing found paths so repeat requests skip the stat calls.
+    Misses are not memoized, so tiles added to the public directory are picked up on the next request.
+    """
+    tile = (image_id, z, x, y)
+    path = _tile_paths.get(tile)
+    if path is not None:
+        _tile_paths.move_to_end(tile)
+        return path
+    path = _locate_source_tile(image_id, z, x, y)
+    if path is not None:
+        _tile_paths[tile] = path
+        if len(_tile_paths) > TILE_PATH_CACHE_LIMIT:
+            _tile_paths.popitem(last=False)
+    return path
+
+def _lru_get(cache: OrderedDict, key):
+    """Look up key in an OrderedDict LRU, marking it most recently used"""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _lru_put(cache: OrderedDict, key, value, limit: int):
+    """Insert into an OrderedDict LRU, evicting the least recently used entry past limit"""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > limit:
+        cache.popitem(last=False)
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    """Encode a progressive JPEG (4:2:0, or greyscale for L tiles), through libjpeg-turbo when available"""
+    if _turbojpeg is not None:
+        if image.mode == 'L':
+            return _turbojpeg.encode(
+                np.asarray(image)[:, :, None],
+                quality=quality,
+                pixel_format=TJPF_GRAY,
+                jpeg_subsample=TJSAMP_GRAY,
+                flags=TJFLAG_PROGRESSIVE
+            )
+        # Palette, CMYK and other modes go through RGB rather than falling back to Pillow's encoder
+        return _turbojpeg.encode(
+            np.asarray(image if image.mode == 'RGB' else image.convert('RGB')),
+            quality=quality,
+            pixel_format=TJPF_RGB,
+            jpeg_subsample=TJSAMP_420,
+            flags=TJFLAG_PROGRESSIVE
+        )
+    
+    img_byte_arr = io.BytesIO()
+    # Progressive JPEGs let clients paint coarse scans while the rest of a chunked response arrives
+    image.save(img_byte_arr, format='JPEG', quality=quality, progressive=True)
+    return img_byte_arr.getvalue()
+
+def _encode_webp(image: Image.Image, quality: int = 82) -> bytes:
+    """Encode a WebP tile, typically 30-40% smaller than the equivalent JPEG"""
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='WEBP', quality=quality, method=4)
+    return img_byte_arr.getvalue()
+
+def _encode_tile(image: Image.Image, format: str = "jpeg") -> bytes:
+    """Encode a processed tile the way it is served and cached"""
+    if format == "webp":
+        return _encode_webp(image)
+    
+    # If it was a PNG originally, we might want to keep that or convert everything to JPEG for speed
+    if image.mode != 'RGBA':
+        return _encode_jpeg(image, quality=85)
+    
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def _open_tile(tile_path: str) -> Image.Image:
+    """Open and fully decode a source tile (Image.open alone defers the decode to first pixel access)"""
+    image = Image.open(tile_path)
+    image.load()
+    return image
+
+def render_source_tile(tile_path: str, enhance: bool) -> bytes:
+    """
+    Render a source tile in a worker process for precomputation.
+    Workers never load Real-ESRGAN, so enhancement takes the CPU Lanczos + denoise path.
+    """
+    if not enhance and tile_path.endswith(".jpg"):
+        # Already a JPEG tile: re-encoding would only cost CPU and quality
+        with open(tile_path, "rb") as f:
+            return f.read()
+    image = Image.open(tile_path)
+    if enhance:
+        image = ml_service._enhance_sync(image)
+    return _encode_tile(image)
+
+if njit is not None:
+    @njit(cache=True, parallel=True, fastmath=True, nogil=True)
+    def box_down_pow2(src, dst, k):
+        """Average each k x k block of a uint8 HxWxC array into one pixel of `dst`"""
+        out_h, out_w, channels = dst.shape
+        area = k * k
+        for row in prange(out_h):
+            for col in range(out_w):
+                for c in range(channels):
+                    acc = 0
+                    for dy in range(k):
+                        for dx in range(k):
+                            acc += src[row * k + dy, col * k + dx, c]
+                    dst[row, col, c] = (acc + area // 2) // area
+else:
+    box_down_pow2 = None
+
+def _box_downsample(region: Image.Image, k: int, size: tuple) -> Image.Image:
+    """Shrink an RGB region by a power-of-two factor with the numba box kernel"""
+    src = np.asarray(region)
+    dst = np.empty((size[1], size[0], src.shape[2]), dtype=np.uint8)
+    box_down_pow2(src, dst, k)
+    return Image.fromarray(dst)
+
+def _vips_crop(raw: bytes, left: int, top: int, right: int, bottom: int, scale: int, size: tuple) -> Image.Image:
+    """
+    Crop a full-res region out of an encoded JPEG/PNG and shrink it to `size` with libvips.
+    JPEGs are decoded with DCT scaling at up to 1/8 size, and sequential access stops decoding below the crop.
+    """
+    shrink = 1
+    if raw.startswith(JPEG_MAGIC):
+        while shrink < 8 and shrink * 2 <= scale:
+            shrink *= 2
+        image = pyvips.Image.new_from_buffer(raw, "", shrink=shrink, access="sequential")
+    else:
+        image = pyvips.Image.new_from_buffer(raw, "", access="sequential")
+    
+    region_left, region_top = left // shrink, top // shrink
+    region = image.crop(
+        region_left,
+        region_top,
+        min(-(-(right - left) // shrink), image.width - region_left),
+        min(-(-(bottom - top) // shrink), image.height - region_top)
+    )
+    region = region.thumbnail_image(size[0], height=size[1], size="force")
+    # Same RGB the Pillow path produces from grey, CMYK, 16-bit or alpha sources
+    if region.interpretation != "srgb":
+        region = region.colourspace("srgb")
+    if region.hasalpha():
+        region = region.flatten()
+    return Image.frombytes("RGB", (region.width, region.height), region.write_to_memory())
+
+def _max_level(width: int, height: int) -> int:
+    """Deepest Deep Zoom / IIIF level of an image: the one served at full resolution"""
+    return math.ceil(math.log2(max(width, height)))
+
+class SourceImage:
+    """
+    A source image held for dynamic tiling: the encoded bytes when libvips can crop them,
+    the decoded RGB image otherwise.
+    """
+    __slots__ = ("width", "height", "raw", "image")
+    
+    def __init__(self, width: int, height: int, raw: Optional[bytes] = None, image: Optional[Image.Image] = None):
+        self.width = width
+        self.height = height
+        self.raw = raw
+        self.image = image
+    
+    @staticmethod
+    def keeps_encoded(content: bytes) -> bool:
+        """Whether bytes starting with `content` are held encoded for libvips rather than decoded"""
+        return pyvips is not None and (content.startswith(JPEG_MAGIC) or content.startswith(PNG_MAGIC))
+    
+    @classmethod
+    def load(cls, content: bytes) -> "SourceImage":
+        """Keep JPEG/PNG bytes for libvips, reading only the header; decode anything else with Pillow"""
+        if cls.keeps_encoded(content):
+            try:
+                header = pyvips.Image.new_from_buffer(content, "")
+                return cls(header.width, header.height, raw=content)
+            except Exception as e:
+                logger.warning(f"libvips could not read source image, decoding with Pillow: {str(e)}")
+        
+        return cls.from_image(Image.open(io.BytesIO(content)))
+    
+    @classmethod
+    def from_image(cls, image: Image.Image) -> "SourceImage":
+        """Hold a decoded image"""
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cls(image.width, image.height, image=image)
+    
+    def shrinks_on_load(self, scale: int) -> bool:
+        """Whether libvips crops this source at `scale` cheaply enough to skip the decoded copy: JPEG DCT scaling at 1/8"""
+        return self.raw is not None and self.raw.startswith(JPEG_MAGIC) and scale >= JPEG_SHRINK_ON_LOAD_SCALE
+    
+    def decode(self) -> "SourceImage":
+        """Fully decoded copy of an encoded source image (blocking; run in a worker thread)"""
+        image = Image.open(io.BytesIO(self.raw))
+        # Loaded up front so concurrent crops never race on Pillow's lazy decode
+        image.load()
+        return SourceImage.from_image(image)
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory held in the source image cache"""
+        if self.raw is not None:
+            return len(self.raw)
+        return self.width * self.height * len(self.image.getbands())
+    
+    def crop(self, left: int, top: int, right: int, bottom: int, scale: int, size: tuple) -> Image.Image:
+        """Crop a full-res region and resize it to `size`, the region shrunk by `scale`"""
+        image = self.image
+        if image is None:
+            try:
+                return _vips_crop(self.raw, left, top, right, bottom, scale, size)
+            except Exception as e:
+                logger.warning(f"libvips crop failed, decoding with Pillow: {str(e)}")
+                image = Image.open(io.BytesIO(self.raw)).convert('RGB')
+        
+        region = image.crop((left, top, right, bottom))
+        if region.mode != 'RGB':
+            # Sources mapped from the disk cache are RGBX
+            region = region.convert('RGB')
+        # DZI levels shrink by exact powers of two, where a box filter matches each output pixel
+        # to a whole block of source pixels; edge crops thinner than one block keep Lanczos
+        if (
+            box_down_pow2 is not None and isinstance(scale, int) and scale >= 2 and scale & (scale - 1) == 0
+            and size[0] * scale <= region.width and size[1] * scale <= region.height
+        ):
+            return _box_downsample(region, scale, size)
+        return region.resize(size, Image.LANCZOS)
+
+class SourceDiskCache:
+    """
+    Source images on local disk, shared by every worker process and kept across restarts.
+    Encoded bytes go in `{hash}.src`; decoded pixels go in `{hash}.rgbx` with a `{hash}.json` size sidecar.
+    RGBX is Pillow's own in-memory layout for RGB, so a hit maps the file read-only without a copy,
+    and workers share its pages. Least recently used entries are evicted past `source_disk_cache_mb`.
+    """
+    def __init__(self):
+        self.directory: Optional[str] = None
+        self.limit = settings.source_disk_cache_mb * 1024 * 1024
+        self.total = 0  # Bytes on disk as of the last directory scan, plus this worker's writes since
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def initialize(self):
+        """Create the cache directory and sweep temp files left by crashed writers; the cache stays disabled on failure"""
+        if not settings.source_disk_cache_dir:
+            return
+        try:
+            os.makedirs(settings.source_disk_cache_dir, exist_ok=True)
+            self.directory = settings.source_disk_cache_dir
+            stale_before = time.time() - SOURCE_DISK_STALE_TMP_AGE
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                        if not entry.name.endswith(".tmp"):
+                            self.total += stat.st_size
+                        elif stat.st_mtime < stale_before:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass  # Evicted or renamed into place by another worker meanwhile
+            # One writer: persisting large images never competes with tile work for the default executor
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="source-disk")
+            logger.info(f"Source image disk cache at {self.directory}")
+        except OSError as e:
+            self.directory = None
+            logger.warning(f"Source image disk cache disabled: {str(e)}")
+
+    def put_in_background(self, url: str, source: SourceImage):
+        """Queue a source image for writing on the cache's own thread"""
+        if self.executor is not None:
+            asyncio.get_running_loop().run_in_executor(self.executor, self.put, url, source)
+
+    def close(self):
+        """Stop the writer thread, letting a write in progress finish"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def _path(self, url: str, suffix: str) -> str:
+        return os.path.join(self.directory, xxhash.xxh3_64_hexdigest(url) + suffix)
+
+    def get(self, url: str) -> Optional[SourceImage]:
+        """Load a cached source image (blocking; run in a worker thread)"""
+        if self.directory is None:
+            return None
+        try:
+            raw_path = self._path(url, ".src")
+            if os.path.exists(raw_path):
+                # mtime doubles as the LRU clock: atime is often disabled on the mount
+                os.utime(raw_path)
+                with open(raw_path, "rb") as f:
+                    return SourceImage.load(f.read())
+            
+            meta_path = self._path(url, ".json")
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                width, height = meta["width"], meta["height"]
+                pixels_path = self._path(url, ".rgbx")
+                os.utime(pixels_path)
+                pixels = np.memmap(pixels_path, dtype=np.uint8, mode="r", shape=(height, width, 4))
+                image = Image.frombuffer("RGBX", (width, height), pixels, "raw", "RGBX", 0, 1)
+                return SourceImage(width, height, image=image)
+        except Exception as e:
+            logger.warning(f"Error reading source image from disk cache: {str(e)}")
+        return None
+
+    def put(self, url: str, source: SourceImage):
+        """Store a source image, then evict down to the size limit (blocking; run in a worker thread)"""
+        if self.directory is None:
+            return
+        try:
+            if source.raw is not None:
+                self._write(self._path(url, ".src"), source.raw)
+                self.total += len(source.raw)
+            else:
+                self._write_pixels(self._path(url, ".rgbx"), source.image)
+                # Written last: readers only look for pixels once the sidecar exists
+                self._write(self._path(url, ".json"), json.dumps({"width": source.width, "height": source.height}).encode())
+                self.total += source.width * source.height * 4
+            # Other workers' writes only show up in a rescan, which runs once this worker's count crosses the limit
+            if self.total > self.limit:
+                self._evict()
+        except Exception as e:
+            logger.warning(f"Error writing source image to disk cache: {str(e)}")
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        # Write-then-rename, so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _write_pixels(path: str, image: Image.Image):
+        # Copied into the mapped file a strip at a time, never holding a second full-size copy in memory
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        width, height = image.size
+        pixels = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(height, width, 4))
+        try:
+            for top in range(0, height, SOURCE_DISK_WRITE_ROWS):
+                bottom = min(top + SOURCE_DISK_WRITE_ROWS, height)
+                strip = image.crop((0, top, width, bottom)).tobytes("raw", "RGBX")
+                pixels[top:bottom] = np.frombuffer(strip, dtype=np.uint8).reshape(bottom - top, width, 4)
+            pixels.flush()
+        finally:
+            del pixels
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        entries: Dict[str, List[Any]] = {}  # hash -> [size, last use, paths]
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                record = entries.setdefault(entry.name.split(".")[0], [0, 0.0, []])
+                record[0] += stat.st_size
+                record[1] = max(record[1], stat.st_mtime)
+                record[2].append(entry.path)
+        
+        total = sum(size for size, _, _ in entries.values())
+        # Evicting below the limit leaves headroom, so the next few puts don't each rescan the directory
+        target = self.limit * SOURCE_DISK_EVICT_TARGET
+        for size, _, paths in sorted(entries.values(), key=lambda record: record[1]):
+            if total <= target:
+                break
+            # Workers that have a file mapped keep reading it after the unlink
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+        self.total = total
+
 class TileService:
     def __init__(self):
         self.ml_service = ml_service
         self.cache_service = cache_service
-        self.http_client = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
-        self.source_image_cache = {} # In-memory cache for full source images during active sessions
+        self.tile_cache = tile_cache
+        # One pooled client for every upstream fetch: keep-alive + HTTP/2 multiplexing to the same origins.
+        # With an explicit transport, HTTP/2 and pool limits must be set on the transport itself.
+        self.http_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=100, max_connections=200, keepalive_expiry=60),
+                retries=2  # Connection failures only; requests that reached the server are never replayed
+            ),
+            # Fail fast on connecting or queueing for a pooled connection; reads allow a stalled chunk 10s
+            timeout=httpx.Timeout(connect=3.0, read=10.0, write=5.0, pool=5.0),
+            follow_redirects=True
+        )
+        self.source_image_cache = OrderedDict() # LRU of SourceImage by URL during active sessions
+        self.source_image_cache_bytes = 0
+        self.source_disk_cache = SourceDiskCache()
+        # Negative cache: (image_id, z, x, y) -> expiry, oldest first. OpenSeadragon requests past the edges a lot
+        self.missing_tiles: OrderedDict = OrderedDict()
+        # Per requested URL, outliving LRU eviction: (width, height, max_level) and the URL actually fetched
+        self.source_meta_cache: OrderedDict = OrderedDict() # (width, height, max_level) by URL
+        self.resolved_urls: OrderedDict = OrderedDict() # NASA thumbnail URL -> original
+        # Source fetches in progress by requested URL, shared by every concurrent caller
+        self._inflight_sources: Dict[str, asyncio.Task] = {}
+        self._inflight_resolutions: Dict[str, asyncio.Task] = {}
+        self.process_pool: Optional[ProcessPoolExecutor] = None
+        self.process_pool_size = 0
+
+    def start_process_pool(self):
+        """Start the worker processes used to fan precomputation out across CPU cores"""
+        # Split the cores between the Uvicorn workers that each start a pool
+        self.process_pool_size = max(1, (os.cpu_count() or 1) // settings.server_workers)
+        # Spawned rather than forked: the parent already holds torch and event-loop threads
+        self.process_pool = ProcessPoolExecutor(
+            max_workers=self.process_pool_size,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Tile process pool started with {self.process_pool_size} workers")
 
     async def _fetch_original_tile(self, image_id: str, z: int, x: int, y: int) -> Optional[bytes]:
         """
         Internal method to fetch the original, unprocessed tile from disk.
         Used by the ML inference engine.
         """
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "public"))
-        
-        possible_paths = [
-            os.path.join(base_dir, f"{image_id}_files", str(z), f"{x}_{y}.jpg"),
-            os.path.join(base_dir, f"{image_id}_files", str(z), f"{x}_{y}.png"),
-            os.path.join(base_dir, "tiles", image_id, str(z), f"{x}_{y}.jpg"),
-        ]
-        
-        for path in possible_paths:
-            if os.path.exists(path):
-                with open(path, "rb") as f:
-                    return f.read()
+        path = _source_tile_path(image_id, z, x, y)
+        if path:
+            async with aiofiles.open(path, "rb") as f:
+                return await f.read()
         return None
+
+    def passthrough_tile_path(self, image_id: str, z: int, x: int, y: int) -> Optional[str]:
+        """
+        Path of a source tile that can be sent as-is for an unprocessed JPEG request,
+        letting the route hand it to the kernel with sendfile instead of decoding and re-encoding it.
+        A tile with no source on disk is recorded as missing so repeat requests skip the probes.
+        """
+        path = _source_tile_path(image_id, z, x, y)
+        if path is None:
+            self._mark_missing((image_id, z, x, y))
+        return path if path and path.endswith(".jpg") else None
         
     async def get_tile(
         self,
@@ -45,47 +575,81 @@ class TileService:
         y: int,
         enhance: bool = False,
         labels: bool = False,
-        confidence_threshold: float = 0.5
+        confidence_threshold: float = 0.5,
+        format: str = "jpeg"
     ) -> Optional[bytes]:
         """
-        Get an image tile with optional ML enhancement and labeling.
+        Get an image tile with optional ML enhancement and labeling, encoded as `format` (jpeg or webp).
         """
+        # Known-absent tiles skip the Redis and S3 lookups entirely
+        if self.is_known_missing(image_id, z, x, y):
+            return None
+        
         # Generate a unique cache key based on all parameters
-        cache_key = f"{image_id}:{z}:{x}:{y}:e{enhance}:l{labels}:c{confidence_threshold}"
+        cache_key = tile_cache_key(image_id, z, x, y, enhance, labels, confidence_threshold, format)
         
-        # 1. Try to get from cache
-        if not self.cache_service.connected:
-            await self.cache_service.initialize()
+        # 1. Try to get from cache (Redis, then S3); initialized by the startup hook, so this is a flag check
+        if not self.cache_service.initialized:
+            await self.cache_service.ensure_initialized()
             
-        cached_tile = await self.cache_service.get_tile(cache_key)
+        cached_tile = await self.tile_cache.get(cache_key)
         if cached_tile:
             logger.debug(f"Cache hit for tile: {cache_key}")
             return cached_tile
             
-        # 2. Find the source tile on disk
-        # We look in the root public directory where DZI files are stored
-        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "public"))
+        tile_data = await self._render_tile(image_id, z, x, y, enhance, labels, confidence_threshold, format)
         
-        # Common DZI tile patterns
-        possible_paths = [
-            os.path.join(base_dir, f"{image_id}_files", str(z), f"{x}_{y}.jpg"),
-            os.path.join(base_dir, f"{image_id}_files", str(z), f"{x}_{y}.png"),
-            os.path.join(base_dir, "tiles", image_id, str(z), f"{x}_{y}.jpg"),
-        ]
+        # 4. Store in both cache tiers
+        if tile_data:
+            await self.tile_cache.set(cache_key, tile_data)
+        elif _source_tile_path(image_id, z, x, y) is None:
+            self._mark_missing((image_id, z, x, y))
         
-        tile_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                tile_path = path
-                break
-                
+        return tile_data
+
+    def is_known_missing(self, image_id: str, z: int, x: int, y: int) -> bool:
+        """Whether a tile was recently found neither in the cache nor on disk"""
+        tile = (image_id, z, x, y)
+        expiry = self.missing_tiles.get(tile)
+        if expiry is None:
+            return False
+        if expiry > time.monotonic():
+            return True
+        del self.missing_tiles[tile]
+        return False
+
+    def _mark_missing(self, tile: tuple):
+        self.missing_tiles[tile] = time.monotonic() + MISSING_TILE_TTL
+        self.missing_tiles.move_to_end(tile)
+        if len(self.missing_tiles) > MISSING_TILE_LIMIT:
+            self.missing_tiles.popitem(last=False)
+
+    async def _render_tile(
+        self,
+        image_id: str,
+        z: int,
+        x: int,
+        y: int,
+        enhance: bool = False,
+        labels: bool = False,
+        confidence_threshold: float = 0.5,
+        format: str = "jpeg"
+    ) -> Optional[bytes]:
+        """Render a source tile with optional enhancement and labels, without touching the cache"""
+        # 2. Find the source tile on disk
+        tile_path = _source_tile_path(image_id, z, x, y)
         if not tile_path:
             logger.warning(f"Tile not found for {image_id} at z={z}, x={x}, y={y}")
             return None
             
-        # 3. Process the tile
+        # 3. Process the tile; decode and encode run in worker threads so other requests keep flowing
         try:
-            image = Image.open(tile_path)
+            if not enhance and not labels and format == "jpeg" and tile_path.endswith(".jpg"):
+                # Pixels stay untouched: serve (and cache) the source JPEG bytes instead of re-encoding them
+                async with aiofiles.open(tile_path, "rb") as f:
+                    return await f.read()
+            
+            image = await asyncio.to_thread(_open_tile, tile_path)
             
             # Ensure ML models are initialized
             if not self.ml_service.models_loaded:
@@ -94,8 +658,7 @@ class TileService:
             # Apply enhancements
             if enhance:
                 logger.debug(f"Applying AI enhancement to tile {image_id}/{z}/{x}/{y}")
-                image = await self.ml_service.super_resolve(image)
-                image = await self.ml_service.denoise(image)
+                image = await self.ml_service.enhance(image)
                 
             # Apply labels
             if labels:
@@ -103,21 +666,19 @@ class TileService:
                 image = await self.ml_service.add_labels(image, confidence_threshold)
                 
             # Convert back to bytes
-            img_byte_arr = io.BytesIO()
-            # If it was a PNG originally, we might want to keep that or convert everything to JPEG for speed
-            save_format = 'JPEG' if image.mode != 'RGBA' else 'PNG'
-            image.save(img_byte_arr, format=save_format, quality=85)
-            tile_data = img_byte_arr.getvalue()
-            
-            # 4. Store in cache
-            await self.cache_service.set_tile(cache_key, tile_data)
-            
-            return tile_data
+            return await asyncio.to_thread(_encode_tile, image, format)
             
         except Exception as e:
             logger.error(f"Error processing tile {tile_path}: {str(e)}")
             return None
 
+    @staticmethod
+    async def stream_tile(tile_data: bytes) -> AsyncIterator[bytes]:
+        """Yield an encoded tile in fixed-size chunks for a chunked StreamingResponse"""
+        view = memoryview(tile_data)
+        for start in range(0, len(view), TILE_STREAM_CHUNK_SIZE):
+            yield bytes(view[start:start + TILE_STREAM_CHUNK_SIZE])
+
     async def get_iiif_info(self, image_url: str) -> Dict[str, Any]:
         """
         Generate IIIF info.json for an external image URL.
@@ -125,14 +686,7 @@ class TileService:
         """
         try:
             # 1. Get image dimensions
-            image = await self._get_full_image(image_url)
-            if not image:
-                raise Exception("Could not load source image")
-            
-            width, height = image.size
-            
-            import math
-            max_level = math.ceil(math.log2(max(width, height)))
+            width, height, max_level = await self._get_source_meta(image_url)
             
             # Simple hash for ID
             image_id = hashlib.md5(image_url.encode()).hexdigest()
@@ -158,6 +712,17 @@ class TileService:
             logger.error(f"Error generating IIIF info: {str(e)}")
             return {}
 
+    async def _get_source_meta(self, image_url: str) -> Tuple[int, int, int]:
+        """(width, height, max_level) of a source image, loading it only the first time"""
+        meta = _lru_get(self.source_meta_cache, image_url)
+        if meta is None:
+            source = await self._get_source_image(image_url)
+            if not source:
+                raise Exception("Could not load source image")
+            meta = (source.width, source.height, _max_level(source.width, source.height))
+            _lru_put(self.source_meta_cache, image_url, meta, SOURCE_META_CACHE_LIMIT)
+        return meta
+
     async def get_dynamic_tile(
         self,
         image_url: str,
@@ -168,37 +733,33 @@ class TileService:
         enhance: bool = False,
         labels: bool = False,
         confidence_threshold: float = 0.5,
-        quality: int = 90
+        quality: int = 90,
+        format: str = "jpeg"
     ) -> Optional[bytes]:
         """
         Dynamically crop a tile from a full image and apply AI enhancement.
         Fixes pixel tearing by providing high-res tiles on demand.
         """
         try:
-            # 1. Load full image
-            full_image = await self._get_full_image(image_url)
-            if not full_image:
-                return None
-            
-            width, height = full_image.size
-            
-            # 2. Calculate maxLevel
-            import math
-            max_level = math.ceil(math.log2(max(width, height)))
-            
-            # 3. Hash URL for cache key
-            url_hash = hashlib.md5(image_url.encode()).hexdigest()
-            cache_key = f"dyn:{url_hash}:{z}:{x}:{y}:e{enhance}:l{labels}:c{confidence_threshold}:q{quality}"
+            # 1. Hash URL for cache key
+            cache_key = dynamic_tile_cache_key(image_url, z, x, y, enhance, labels, confidence_threshold, quality, format)
             
-            # 4. Check cache
-            if not self.cache_service.connected:
-                await self.cache_service.initialize()
+            # 2. Check cache: the key depends only on the request, so hits never touch the source image
+            if not self.cache_service.initialized:
+                await self.cache_service.ensure_initialized()
             
-            cached_tile = await self.cache_service.get_tile(cache_key)
+            # Redis only (dynamic tiles are not kept in S3), coalesced with the rest of the viewport's reads
+            cached_tile = await self.tile_cache.redis.get(cache_key)
             if cached_tile:
                 return cached_tile
             
-            # 5. Calculate crop area based on OSD level system
+            # 3. Dimensions and maxLevel, memoized per URL
+            try:
+                width, height, max_level = await self._get_source_meta(image_url)
+            except Exception:
+                return None
+            
+            # 4. Calculate crop area based on OSD level system
             # OSD Deep Zoom Level 0 is the smallest (1x1 or close)
             # Max level is the full res image.
             # Scale at level z is 1 / 2^(max_level - z)
@@ -216,8 +777,14 @@ class TileService:
                 logger.debug(f"Tile out of bounds: {x},{y} at z={z} (scale {scale})")
                 return None
             
-            # Crop the high-res region
-            tile_image = full_image.crop((int(left), int(top), int(right), int(bottom)))
+            # 5. Only in-bounds misses need the pixels
+            source = await self._get_source_image(image_url)
+            if not source:
+                return None
+            # libvips decodes every row above the crop again for each tile, which only pays off when a JPEG
+            # shrinks 8x on load; every other crop comes from a copy decoded once per source
+            if source.raw is not None and not source.shrinks_on_load(scale):
+                source = await self._get_decoded_source(image_url, source)
             
             # Resize the cropped region to the requested tile size (or proportional)
             # This ensures OSD gets exactly what it expects for its grid
@@ -228,7 +795,10 @@ class TileService:
             target_w = max(1, target_w)
             target_h = max(1, target_h)
             
-            tile_image = tile_image.resize((target_w, target_h), Image.LANCZOS)
+            # Crop the high-res region and shrink it off the event loop
+            tile_image = await asyncio.to_thread(
+                source.crop, int(left), int(top), int(right), int(bottom), scale, (target_w, target_h)
+            )
             
             # 6. Enhance
             if not self.ml_service.models_loaded:
@@ -236,106 +806,348 @@ class TileService:
                 
             if enhance:
                 # Apply enhancement to the tile
-                tile_image = await self.ml_service.super_resolve(tile_image)
-                tile_image = await self.ml_service.denoise(tile_image)
+                tile_image = await self.ml_service.enhance(tile_image)
                 # Keep it high quality
             
             if labels:
                 tile_image = await self.ml_service.add_labels(tile_image, confidence_threshold)
             
             # 7. Save and Cache
-            img_byte_arr = io.BytesIO()
-            tile_image.save(img_byte_arr, format='JPEG', quality=quality)
-            tile_data = img_byte_arr.getvalue()
+            if format == "webp":
+                tile_data = await asyncio.to_thread(_encode_webp, tile_image)
+            else:
+                tile_data = await asyncio.to_thread(_encode_jpeg, tile_image, quality)
             
-            await self.cache_service.set_tile(cache_key, tile_data)
+            await self.tile_cache.redis.set(cache_key, tile_data)
             return tile_data
             
         except Exception as e:
             logger.error(f"Error in dynamic tiling: {str(e)}")
             return None
 
-    async def _get_full_image(self, url: str) -> Optional[Image.Image]:
+    async def _get_source_image(self, url: str) -> Optional[SourceImage]:
+        """
+        Get a source image from the LRU, or join the one fetch in flight for it.
+        Opening a viewport fires dozens of tile requests for the same URL at once.
+        """
+        # Keyed on the resolved URL so a thumbnail and its original share one download
+        actual_url = _lru_get(self.resolved_urls, url)
+        if actual_url is None:
+            actual_url = await self._join_inflight(self._inflight_resolutions, url, lambda: self._resolve_source_url(url))
+        
+        cached_source = self.source_image_cache.get(actual_url)
+        if cached_source is not None:
+            self.source_image_cache.move_to_end(actual_url)
+            return cached_source
+        
+        return await self._join_inflight(
+            self._inflight_sources, actual_url, lambda: self._load_source_image(url, actual_url)
+        )
+
+    @staticmethod
+    async def _join_inflight(inflight: Dict[str, asyncio.Task], key: str, start):
+        """Await the task running for key, starting it if none is in flight"""
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(start())
+            inflight[key] = task
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        # Shielded so a disconnecting client doesn't cancel the work the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _get_decoded_source(self, url: str, source: SourceImage) -> SourceImage:
+        """Decoded counterpart of an encoded source image, decoded once and kept in the source image LRU"""
+        if source.width * source.height * 3 > settings.source_image_cache_mb * 1024 * 1024:
+            return source
+        key = ("decoded", _lru_get(self.resolved_urls, url) or url)
+        decoded = _lru_get(self.source_image_cache, key)
+        if decoded is not None:
+            return decoded
+        return await self._join_inflight(self._inflight_sources, key, lambda: self._decode_source(key, source))
+
+    async def _decode_source(self, key: tuple, source: SourceImage) -> SourceImage:
+        try:
+            decoded = await asyncio.to_thread(source.decode)
+        except Exception as e:
+            logger.warning(f"Could not decode source image, cropping it encoded: {str(e)}")
+            return source
+        self._cache_source_image(key, decoded)
+        return decoded
+
+    async def _resolve_source_url(self, url: str) -> str:
+        """
+        Map a NASA thumbnail/mobile URL to its original. Resolutions are memoized per worker and shared
+        through Redis, so the images-api asset lookup runs once per image rather than once per worker.
+        """
+        resolved = _lru_get(self.resolved_urls, url)
+        if resolved is not None:
+            return resolved
+        if "nasa.gov" not in url or ("~thumb" not in url and "~mobile" not in url):
+            return url
+        
+        match = NASA_ID_PATTERN.search(url)
+        if not match:
+            _lru_put(self.resolved_urls, url, url, RESOLVED_URL_LIMIT)
+            return url
+        nasa_id = match.group(1)
+        
+        shared = await self.cache_service.get_metadata(f"nasa_original:{nasa_id}")
+        if shared:
+            _lru_put(self.resolved_urls, url, shared["url"], RESOLVED_URL_LIMIT)
+            return shared["url"]
+        
+        actual_url = url
+        try:
+            logger.info(f"Resolving NASA original for {nasa_id}")
+            asset_resp = await self.http_client.get(f"https://images-api.nasa.gov/asset/{nasa_id}")
+            if asset_resp.status_code == 200:
+                assets = asset_resp.json()
+                links = [item['href'] for item in assets['collection']['items']]
+                # Prioritize ~orig.jpg
+                orig = next((l for l in links if "~orig" in l and l.lower().endswith(('.jpg', '.jpeg', '.png'))), None)
+                if orig:
+                    actual_url = orig
+                    logger.info(f"Resolved to original: {actual_url}")
+                    await self.cache_service.set_metadata(
+                        f"nasa_original:{nasa_id}", {"url": actual_url}, ttl=NASA_RESOLUTION_TTL
+                    )
+            # Transient failures (exceptions) are retried on the next request
+            _lru_put(self.resolved_urls, url, actual_url, RESOLVED_URL_LIMIT)
+        except Exception as e:
+            logger.warning(f"Failed to resolve NASA original, using provided URL: {str(e)}")
+        return actual_url
+
+    async def _load_source_image(self, url: str, actual_url: Optional[str] = None) -> Optional[SourceImage]:
         """Fetch and cache full source image in memory for tiling"""
         # 1. Attempt to resolve NASA thumbnails to originals
-        actual_url = url
-        if "nasa.gov" in url and ("~thumb" in url or "~mobile" in url):
-            try:
-                # Extract NASA ID from URL
-                # e.g., https://.../image/PIA12345/PIA12345~thumb.jpg
-                parts = url.split('/')
-                nasa_id = None
-                for i, part in enumerate(parts):
-                    if part == 'image' and i + 1 < len(parts):
-                        nasa_id = parts[i+1]
-                        break
-                
-                if nasa_id:
-                    logger.info(f"Resolving NASA original for {nasa_id}")
-                    asset_resp = await self.http_client.get(f"https://images-api.nasa.gov/asset/{nasa_id}")
-                    if asset_resp.status_code == 200:
-                        assets = asset_resp.json()
-                        links = [item['href'] for item in assets['collection']['items']]
-                        # Prioritize ~orig.jpg
-                        orig = next((l for l in links if "~orig" in l and l.lower().endswith(('.jpg', '.jpeg', '.png'))), None)
-                        if orig:
-                            actual_url = orig
-                            logger.info(f"Resolved to original: {actual_url}")
-            except Exception as e:
-                logger.warning(f"Failed to resolve NASA original, using provided URL: {str(e)}")
+        if actual_url is None:
+            actual_url = await self._resolve_source_url(url)
 
-        if actual_url in self.source_image_cache:
-            return self.source_image_cache[actual_url]
+        cached_source = self.source_image_cache.get(actual_url)
+        if cached_source is not None:
+            self.source_image_cache.move_to_end(actual_url)
+            return cached_source
+        
+        # Another worker (or this one before a restart) may already have fetched it
+        disk_source = await asyncio.to_thread(self.source_disk_cache.get, actual_url)
+        if disk_source is not None:
+            self._cache_source_image(actual_url, disk_source)
+            return disk_source
         
         try:
             logger.info(f"Fetching full image from {actual_url}")
-            # Use a more aggressive timeout for the individual image fetch
-            # to prevent the whole tiling engine from hanging.
-            response = await self.http_client.get(actual_url, timeout=10.0)
-            if response.status_code == 200:
-                image = Image.open(io.BytesIO(response.content))
-                # Convert to RGB if necessary
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                    
-                # Keep only a few images in memory
-                if len(self.source_image_cache) > 3:
-                    self.source_image_cache.pop(next(iter(self.source_image_cache)))
-                self.source_image_cache[actual_url] = image
-                return image
+            # The client's connect/read timeouts keep a stalled origin from hanging the tiling engine
+            async with self.http_client.stream("GET", actual_url) as response:
+                status_code = response.status_code
+                source = await self._read_source_image(response) if status_code == 200 else None
+            if source is not None:
+                self._cache_source_image(actual_url, source)
+                # Persisted in the background; the tile never waits on the disk write
+                self.source_disk_cache.put_in_background(actual_url, source)
+                return source
             elif actual_url != url:
-                # If we tried the original and it failed, fallback to the thumbnail
+                # If we tried the original and it failed, fallback to the thumbnail (and stick with it)
                 logger.warning(f"Failed to fetch original, falling back to thumbnail: {url}")
-                return await self._get_full_image(url)
+                _lru_put(self.resolved_urls, url, url, RESOLVED_URL_LIMIT)
+                self.source_meta_cache.pop(url, None)
+                return await self._load_source_image(url)
             else:
-                logger.error(f"Failed to fetch image: {response.status_code}")
+                logger.error(f"Failed to fetch image: {status_code}")
                 return None
         except httpx.TimeoutException:
             if actual_url != url:
                 logger.warning(f"Timeout fetching original {actual_url}, falling back to thumbnail {url}")
-                return await self._get_full_image(url)
+                _lru_put(self.resolved_urls, url, url, RESOLVED_URL_LIMIT)
+                self.source_meta_cache.pop(url, None)
+                return await self._load_source_image(url)
             logger.error(f"Timeout fetching source image {actual_url}")
             return None
         except Exception as e:
             logger.error(f"Error fetching source image: {str(e)}")
             return None
 
+    async def _read_source_image(self, response: httpx.Response) -> SourceImage:
+        """
+        Read a streamed source image without blocking the event loop. Bytes kept encoded for libvips
+        are only collected; anything else is fed to Pillow's incremental parser in a worker thread
+        while the next chunk downloads, so decoding overlaps the transfer.
+        """
+        chunks = []
+        parser = None
+        feeding = None
+        async for chunk in response.aiter_bytes(SOURCE_DOWNLOAD_CHUNK_SIZE):
+            if not chunks and not SourceImage.keeps_encoded(chunk):
+                parser = ImageFile.Parser()
+            chunks.append(chunk)
+            if parser is not None:
+                # Feeds stay in order: the parser holds decoder state between them
+                try:
+                    if feeding is not None:
+                        await feeding
+                    feeding = asyncio.ensure_future(asyncio.to_thread(parser.feed, chunk))
+                except Exception as e:
+                    logger.warning(f"Incremental decode failed, decoding once downloaded: {str(e)}")
+                    parser = feeding = None
+        
+        content = b"".join(chunks)
+        if parser is None:
+            return await asyncio.to_thread(SourceImage.load, content)
+        
+        try:
+            await feeding
+            image = await asyncio.to_thread(parser.close)
+            return await asyncio.to_thread(SourceImage.from_image, image)
+        except Exception as e:
+            logger.warning(f"Incremental decode failed, decoding the downloaded bytes: {str(e)}")
+            return await asyncio.to_thread(SourceImage.load, content)
+
+    def _cache_source_image(self, url: str, source: SourceImage):
+        """Keep a source image, evicting least recently used ones past `source_image_cache_mb`"""
+        limit = settings.source_image_cache_mb * 1024 * 1024
+        size = source.nbytes
+        if size > limit:
+            return
+        
+        replaced = self.source_image_cache.pop(url, None)
+        if replaced is not None:
+            self.source_image_cache_bytes -= replaced.nbytes
+        self.source_image_cache[url] = source
+        self.source_image_cache_bytes += size
+        while self.source_image_cache_bytes > limit and self.source_image_cache:
+            _, evicted = self.source_image_cache.popitem(last=False)
+            self.source_image_cache_bytes -= evicted.nbytes
+
+    def _list_source_tiles(self, image_id: str, z: int) -> List[tuple]:
+        """List the (x, y) coordinates of every source tile on disk at a zoom level"""
+        coords = set()
+        for level_dir in (
+            os.path.join(_BASE_DIR, f"{image_id}_files", str(z)),
+            os.path.join(_BASE_DIR, "tiles", image_id, str(z)),
+        ):
+            if not os.path.isdir(level_dir):
+                continue
+            for name in os.listdir(level_dir):
+                match = TILE_FILE_PATTERN.match(name)
+                if match:
+                    coords.add((int(match.group(1)), int(match.group(2))))
+        return sorted(coords)
+
     async def precompute_tiles(
         self,
         image_id: str,
         zoom_levels: List[int],
-        enhance: bool = True
+        enhance: bool = True,
+        job_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
-        Placeholder for precomputing tiles for fixed zoom levels.
+        Render and cache every source tile at the given zoom levels.
+        Progress is kept in the `precompute:{job_id}` status hash as done/total.
         """
-        logger.info(f"Started precomputation for image {image_id}, zooms: {zoom_levels}")
-        return {
-            "status": "success",
-            "message": "Precomputation task queued",
-            "image_id": image_id,
-            "processed_zooms": zoom_levels
-        }
+        status_key = f"precompute:{job_id}"
+        tasks: List[asyncio.Future] = []
+        try:
+            logger.info(f"Started precomputation for image {image_id}, zooms: {zoom_levels}")
+            # Precompute walks the directories itself; drop cached lookups that predate new tiles
+            _tile_paths.clear()
+            self.missing_tiles.clear()
+            coords = []
+            for z in zoom_levels:
+                tiles = await asyncio.to_thread(self._list_source_tiles, image_id, z)
+                coords.extend((z, x, y) for x, y in tiles)
+            
+            total = len(coords)
+            keys = [tile_cache_key(image_id, z, x, y, enhance) for z, x, y in coords]
+            
+            # One MGET per batch rather than a GET per tile to find what is already cached
+            missing = []
+            for start in range(0, total, TILE_WRITE_BATCH_SIZE):
+                batch = list(zip(coords[start:start + TILE_WRITE_BATCH_SIZE], keys[start:start + TILE_WRITE_BATCH_SIZE]))
+                hits = await self.tile_cache.get_many([cache_key for _, cache_key in batch])
+                missing.extend(item for item, hit in zip(batch, hits) if not hit)
+            
+            done = total - len(missing)
+            status = {"status": "running", "image_id": image_id, "done": done, "total": total}
+            await self.cache_service.set_status(status_key, status)
+            
+            # With no Real-ESRGAN model every step is plain CPU work, so spread it over worker processes;
+            # a loaded model stays in this process where it already lives on the GPU
+            use_pool = self.process_pool is not None and not self.ml_service.models.get('sr')
+            concurrency = max(settings.precompute_concurrency, self.process_pool_size) if use_pool else settings.precompute_concurrency
+            semaphore = asyncio.Semaphore(concurrency)
+            pending = {}
+            last_report = time.monotonic()
+            
+            async def report():
+                nonlocal last_report
+                last_report = time.monotonic()
+                await self.cache_service.set_status(status_key, {**status, "done": done})
+            
+            async def flush():
+                nonlocal pending
+                batch, pending = pending, {}
+                if batch:
+                    await self.tile_cache.set_many(batch)
+                    await report()
+            
+            async def render(z, x, y, cache_key):
+                nonlocal done
+                async with semaphore:
+                    if use_pool:
+                        tile_data = await self._render_in_pool(image_id, z, x, y, enhance)
+                    else:
+                        tile_data = await self._render_tile(image_id, z, x, y, enhance=enhance)
+                    if tile_data:
+                        pending[cache_key] = tile_data
+                        if len(pending) >= TILE_WRITE_BATCH_SIZE:
+                            await flush()
+                done += 1
+                # Progress goes out with each flushed batch, or on an interval when renders yield nothing to flush
+                if time.monotonic() - last_report >= PRECOMPUTE_STATUS_INTERVAL:
+                    await report()
+            
+            tasks = [asyncio.ensure_future(render(z, x, y, cache_key)) for (z, x, y), cache_key in missing]
+            await asyncio.gather(*tasks)
+            await flush()
+            
+            result = {"status": "completed", "image_id": image_id, "done": done, "total": total}
+            await self.cache_service.set_status(status_key, result)
+            logger.info(f"Precomputed {done} tiles for image {image_id}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error precomputing tiles for {image_id}: {str(e)}")
+            # Stop the remaining renders so none of them reports progress over the final status
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            result = {"status": "error", "image_id": image_id, "message": str(e)}
+            await self.cache_service.set_status(status_key, result)
+            return result
+
+    async def _render_in_pool(self, image_id: str, z: int, x: int, y: int, enhance: bool) -> Optional[bytes]:
+        """Render one source tile in the process pool"""
+        tile_path = _source_tile_path(image_id, z, x, y)
+        if not tile_path:
+            return None
+        
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.process_pool, render_source_tile, tile_path, enhance)
+        except Exception as e:
+            logger.error(f"Error rendering tile {image_id}/{z}/{x}/{y} in the process pool: {str(e)}")
+            return None
+
+    async def close(self):
+        """Close the shared HTTP client and worker processes"""
+        try:
+            if self.process_pool is not None:
+                self.process_pool.shutdown(wait=False, cancel_futures=True)
+                self.process_pool = None
+            self.source_disk_cache.close()
+            await self.http_client.aclose()
+            logger.info("Tile service closed")
+        except Exception as e:
+            logger.error(f"Error closing tile service: {str(e)}")
 
 # Global instance
 tile_service = TileService()